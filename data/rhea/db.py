@@ -1,17 +1,33 @@
+from mechsearch.grammar_cache import default_cache_directory
 import mod
 import os
 import json
-from typing import List, Iterator
+import multiprocessing as mp
+import re
+from typing import Any, Callable, Dict, Iterable, List, Iterator, Optional, Set, Tuple
+
+# whitespace and commas between the entries of the JSON array
+_separator = re.compile(r"[\s,]*")
+
+
+def _parse_outcome(dfs: str) -> Optional[str]:
+    """Returns the error message if the molecule cannot be parsed."""
+    try:
+        mod.graphDFS(dfs, add=False)
+        return None
+    except mod.InputError as e:
+        return str(e)
 
 
 class RheaDB:
     class Reaction:
-        def __init__(self, json_entry):
+        def __init__(self, json_entry, parse: Optional[Callable[[Dict[str, str]], mod.Graph]] = None):
             self._rhea_id: str = json_entry["rhea_id"]
             self._ec: str = json_entry["ec"]
-            parse = mod.graphDFS
-            self._reactants: List[mod.Graph] = [parse(r["dfs"], name=r["name"]) for r in json_entry["reactants"]]
-            self._products: List[mod.Graph] = [parse(p["dfs"], name=p["name"]) for p in json_entry["products"]]
+            if parse is None:
+                parse = lambda molecule: mod.graphDFS(molecule["dfs"], name=molecule["name"])
+            self._reactants: List[mod.Graph] = [parse(r) for r in json_entry["reactants"]]
+            self._products: List[mod.Graph] = [parse(p) for p in json_entry["products"]]
 
         def serialize(self):
             return {
@@ -41,21 +57,135 @@ class RheaDB:
         def products(self) -> List[mod.Graph]:
             return list(self._products)
 
-    def __init__(self):
-        dir_path = os.path.dirname(__file__)
-        db_path = os.path.join(dir_path, "reactions.json")
-        with open(db_path) as f:
-            self._db = json.load(f)
+    def __init__(self, db_path: Optional[str] = None, cache_directory: str = default_cache_directory):
+        """
+        Reactions are read from `db_path`, by default "reactions.json" next to this file, only when they are
+        requested, through an index of the byte offset of every entry. Molecules are parsed once and shared by all
+        reactions of the database. The index and the molecules that cannot be parsed are stored in
+        "cache_directory/rhea" and reused as long as the database file is unchanged.
+        """
+        self._db_path: str = db_path if db_path is not None else os.path.join(os.path.dirname(__file__),
+                                                                              "reactions.json")
+        self._cache_directory: str = os.path.join(cache_directory, "rhea")
+        self._entries: List[Tuple[str, int, int]] = self._load_index()
+        self._id2idx: Dict[str, int] = {rhea_id: i for i, (rhea_id, _, _) in enumerate(self._entries)}
 
-        self._id2idx = {r["rhea_id"]: i for i, r in enumerate(self._db)}
+        self._molecules: Dict[Tuple[str, str], mod.Graph] = {}
+        self._molecules_path: str = os.path.join(self._cache_directory, "molecules.json")
+        self._parse_errors: Dict[str, Optional[str]] = {}
+        if os.path.exists(self._molecules_path):
+            with open(self._molecules_path) as f:
+                self._parse_errors = json.load(f)
 
-    def get_reaction(self, rhea_id: str):
-        idx = self._id2idx[rhea_id]
-        return RheaDB.Reaction(self._db[idx])
+    def _store(self, path: str, content: Any):
+        os.makedirs(self._cache_directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(content, f)
+
+        os.replace(temporary_path, path)
+
+    def _load_index(self) -> List[Tuple[str, int, int]]:
+        stat = os.stat(self._db_path)
+        index_path = os.path.join(self._cache_directory, f"reactions.{stat.st_size}.{stat.st_mtime_ns}.idx")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return [tuple(entry) for entry in json.load(f)]
 
-    def reactions(self) -> Iterator['RheaDB.Reaction']:
-        for r in self._db:
+        with open(self._db_path, "rb") as f:
+            # every byte is a single character in latin-1, so positions in the text are byte offsets in the file
+            text = f.read().decode("latin-1")
+
+        decoder = json.JSONDecoder()
+        entries: List[Tuple[str, int, int]] = []
+        position = _separator.match(text, text.index("[") + 1).end()
+        while position < len(text) and text[position] != "]":
+            entry, end = decoder.raw_decode(text, position)
+            entries.append((entry["rhea_id"], position, end - position))
+            position = _separator.match(text, end).end()
+
+        self._store(index_path, entries)
+        return entries
+
+    def _read_entry(self, f, idx: int) -> Dict[str, Any]:
+        _, offset, length = self._entries[idx]
+        f.seek(offset)
+        return json.loads(f.read(length))
+
+    def _parse(self, molecule: Dict[str, str]) -> mod.Graph:
+        key = (molecule["name"], molecule["dfs"])
+        if key not in self._molecules:
             try:
-                yield RheaDB.Reaction(r)
-            except mod.InputError:
-                pass
+                self._molecules[key] = mod.graphDFS(molecule["dfs"], name=molecule["name"])
+            except mod.InputError as e:
+                self._parse_errors[molecule["dfs"]] = str(e)
+                raise
+            self._parse_errors[molecule["dfs"]] = None
+
+        return self._molecules[key]
+
+    def _is_invalid(self, json_entry: Dict[str, Any]) -> bool:
+        return any(self._parse_errors.get(molecule["dfs"]) is not None for
+                   molecule in json_entry["reactants"] + json_entry["products"])
+
+    def __contains__(self, rhea_id: str) -> bool:
+        return rhea_id in self._id2idx
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def reaction_ids(self) -> List[str]:
+        return [rhea_id for rhea_id, _, _ in self._entries]
+
+    def get_reaction(self, rhea_id: str):
+        with open(self._db_path, "rb") as f:
+            return RheaDB.Reaction(self._read_entry(f, self._id2idx[rhea_id]), self._parse)
+
+    def reactions(self, rhea_ids: Optional[Iterable[str]] = None) -> Iterator['RheaDB.Reaction']:
+        """
+        Yields the reactions with the given ids, or all reactions, in the order of the database. Reactions with a
+        molecule that cannot be parsed are skipped, and after a pass over all reactions the molecules that cannot be
+        parsed are stored.
+        """
+        indices = range(len(self._entries)) if rhea_ids is None else sorted(self._id2idx[i] for i in rhea_ids)
+        with open(self._db_path, "rb") as f:
+            for idx in indices:
+                json_entry = self._read_entry(f, idx)
+                if self._is_invalid(json_entry):
+                    continue
+                try:
+                    yield RheaDB.Reaction(json_entry, self._parse)
+                except mod.InputError:
+                    pass
+
+        if rhea_ids is None:
+            self.save()
+
+    def precompute_parse_errors(self, num_workers: Optional[int] = None) -> Dict[str, str]:
+        """
+        Finds the molecules of the database that cannot be parsed, checking those not checked before in
+        `num_workers` forked processes, and stores them, such that `reactions` skips their reactions without parsing
+        them. No graphs are kept, MOD graphs cannot be passed between processes, so the molecules of the requested
+        reactions are still parsed by this process.
+        :return: the error message of every molecule that cannot be parsed, by its DFS string.
+        """
+        unparsed: Set[str] = set()
+        with open(self._db_path, "rb") as f:
+            for idx in range(len(self._entries)):
+                json_entry = self._read_entry(f, idx)
+                unparsed.update(molecule["dfs"] for molecule in json_entry["reactants"] + json_entry["products"]
+                                if molecule["dfs"] not in self._parse_errors)
+
+        if unparsed:
+            molecules = sorted(unparsed)
+            num_workers = num_workers if num_workers is not None else os.cpu_count()
+            with mp.get_context("fork").Pool(num_workers) as pool:
+                outcomes = pool.map(_parse_outcome, molecules, chunksize=max(1, len(molecules) // (4 * num_workers)))
+            self._parse_errors.update(zip(molecules, outcomes))
+        self.save()
+
+        return {dfs: error for dfs, error in self._parse_errors.items() if error is not None}
+
+    def save(self):
+        """Stores the outcome of parsing the molecules parsed so far."""
+        self._store(self._molecules_path, self._parse_errors)
@@ -1,16 +1,20 @@
 _root_path_folder = "examples_prelims"
 #_root_path_folder = "/opt/mechsearch"
 
+import os
 import sys 
+# the packages of the repository take precedence over the older copies in the examples folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(_root_path_folder)
 from mechsearch.state_space import StateSpace
 from mechsearch.grammar import Grammar
 from mechsearch import explore
+from mechsearch.result_cache import StateSpaceCache, state_space_key
+from mechsearch.sampling import MechanismSampler
 from data.rhea.db import RheaDB
-from typing import Dict, List
+from typing import Dict, List, Optional
 import json
 import mod
-import itertools
 
 def _load_amino_map():
     grammar_aminos = Grammar()
@@ -27,7 +31,7 @@ def _build_base_grammar() -> Grammar:
 
 
 def build_state_space(rhea_id: str, amino_acids: List[mod.Graph],
-                      k: int = 6):
+                      k: int = 6, cache: Optional[StateSpaceCache] = None):
     rhea_db = RheaDB()
     reaction: RheaDB.Reaction = rhea_db.get_reaction(rhea_id)
 
@@ -35,17 +39,30 @@ def build_state_space(rhea_id: str, amino_acids: List[mod.Graph],
     grammar.append_initial(reaction.reactants + amino_acids)
     grammar.append_target(reaction.products + amino_acids)
 
-    state_space = StateSpace(grammar)
-    explore.bidirectional_bfs(state_space, k)
+    key, state_space = None, None
+    if cache is not None:
+        key = state_space_key(reaction.reactants, reaction.products, amino_acids, grammar.rule_fingerprint, k,
+                              {"function": "bidirectional_bfs"})
+        state_space = cache.load(key, grammar)
+    if state_space is None:
+        state_space = StateSpace(grammar)
+        explore.bidirectional_bfs(state_space, k)
+        if cache is not None:
+            cache.store(key, state_space)
+
     state_space.freeze()
     return state_space
 
 
-def sample_mechanisms(state_space: StateSpace, num_samples: int):
+def sample_mechanisms(state_space: StateSpace, num_samples: int, k: int = 6, seed: Optional[int] = None):
+    """
+    Draws `num_samples` mechanisms of length at most `k` that do not revisit a state, uniformly at random among all
+    such mechanisms. Paths going back and forth between states are rejected, which may take many attempts for
+    larger `k`.
+    """
     state_space.freeze()
-    path_gen = explore.shortest_simple_paths(state_space, algorithm="bidirectional_dijkstra")
-    paths = itertools.islice(path_gen, num_samples)
-    return paths
+    sampler = MechanismSampler(state_space, k, seed=seed)
+    return sampler.stream(num_samples, simple=True)
 
 
 def _run_bfs(graph, source, inverse: bool = False):
@@ -0,0 +1,205 @@
+from mechsearch.grammar import Grammar
+from mechsearch.state_space import StateSpace
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class StateSpaceArchive:
+    """
+    Single-file archive of state spaces and their DG dumps, keyed by e.g. RHEA ids. Entries are only ever appended to
+    the data file `path`, and an index of JSON lines in `path + ".idx"` maps every key to the offset and length of its
+    entry. The index line is written after the data, so an interrupted append at most leaves unreferenced bytes. When
+    a key is appended again, its last entry is the valid one.
+
+    Appends are serialised by a file lock. Concurrent producers, e.g. batch workers, should stage their entries for
+    a single `ArchiveWriter` instead of opening the archive themselves.
+    """
+
+    def __init__(self, path: str, compress: bool = True):
+        self._path: str = path
+        self._index_path: str = f"{path}.idx"
+        self._compress: bool = compress
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_size: int = 0
+        self._refresh()
+
+    def _refresh(self):
+        """Reads the index lines appended since the last refresh, e.g. by a writer in another process."""
+        if not os.path.exists(self._index_path):
+            return
+
+        data_size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_size)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # a partially written last line
+                    break
+                self._index_size += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the remains of an interrupted append
+                    continue
+                if entry["offset"] + entry["state_space_length"] + entry["dg_length"] <= data_size:
+                    self._index[entry["key"]] = entry
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def keys(self) -> List[str]:
+        self._refresh()
+        return list(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        self._refresh()
+        return key in self._index
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._index)
+
+    def append(self, key: str, state_space_json: Dict[str, Any], dg_dump: bytes):
+        state_space_bytes = json.dumps(state_space_json).encode()
+        if self._compress:
+            state_space_bytes = zlib.compress(state_space_bytes)
+            dg_dump = zlib.compress(dg_dump)
+
+        with open(self._path, "ab") as data_file, open(self._index_path, "ab") as index_file:
+            fcntl.flock(data_file, fcntl.LOCK_EX)
+            try:
+                offset = data_file.seek(0, os.SEEK_END)
+                data_file.write(state_space_bytes)
+                data_file.write(dg_dump)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+
+                entry = {"key": key, "offset": offset, "state_space_length": len(state_space_bytes),
+                         "dg_length": len(dg_dump), "compressed": self._compress}
+                line = json.dumps(entry).encode() + b"\n"
+                if index_file.seek(0, os.SEEK_END) > 0 and not _ends_with_newline(self._index_path):
+                    line = b"\n" + line
+                index_file.write(line)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            finally:
+                fcntl.flock(data_file, fcntl.LOCK_UN)
+
+        self._refresh()
+
+    def append_state_space(self, key: str, state_space: StateSpace):
+        self.append(key, *dump_state_space(state_space))
+
+    def _read_entry(self, data_file, entry: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        data_file.seek(entry["offset"])
+        state_space_bytes = data_file.read(entry["state_space_length"])
+        dg_dump = data_file.read(entry["dg_length"])
+        if entry["compressed"]:
+            state_space_bytes = zlib.decompress(state_space_bytes)
+            dg_dump = zlib.decompress(dg_dump)
+
+        return json.loads(state_space_bytes), dg_dump
+
+    def read(self, key: str) -> Tuple[Dict[str, Any], bytes]:
+        """Returns the state space JSON and the DG dump stored under the key."""
+        self._refresh()
+        with open(self._path, "rb") as data_file:
+            return self._read_entry(data_file, self._index[key])
+
+    def stream(self) -> Iterator[Tuple[str, Dict[str, Any], bytes]]:
+        """Yields the key, state space JSON and DG dump of every entry in the order they are stored on disk."""
+        self._refresh()
+        with open(self._path, "rb") as data_file:
+            for entry in sorted(self._index.values(), key=lambda entry: entry["offset"]):
+                state_space_json, dg_dump = self._read_entry(data_file, entry)
+                yield entry["key"], state_space_json, dg_dump
+
+    def load_state_space(self, key: str, grammar: Grammar) -> StateSpace:
+        return state_space_from_dump(*self.read(key), grammar)
+
+
+def dump_state_space(state_space: StateSpace, directory: Optional[str] = None) -> Tuple[Dict[str, Any], bytes]:
+    """
+    :param directory: where the DG is dumped to a file of its own before it is read, by default the temp directory.
+        MOD's default dump names come from a counter that forked workers inherit, so they may collide.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as dump_directory:
+        dump_path = state_space.derivation_graph.dump(os.path.join(dump_directory, "dg.dg"))
+        with open(dump_path, "rb") as f:
+            dg_dump = f.read()
+
+    return state_space.to_json(), dg_dump
+
+
+def state_space_from_dump(state_space_json: Dict[str, Any], dg_dump: bytes, grammar: Grammar) -> StateSpace:
+    # the DG can only be loaded from a file
+    with tempfile.NamedTemporaryFile(suffix=".dg") as dg_file:
+        dg_file.write(dg_dump)
+        dg_file.flush()
+        return StateSpace.from_json(state_space_json, grammar, dg_file.name)
+
+
+class ArchiveWriter:
+    """
+    Single writer of an archive in the supervising process of a batch. Worker processes `stage` their entry in a
+    file of their own in the directory `archive.path + ".staging"` and report its path, and the supervisor `commit`s
+    the staged entry to the archive before it records the task as completed. Entries are never sent through a pipe,
+    so a killed worker at most leaves a partially staged file, which `start` removes.
+    """
+
+    def __init__(self, archive: StateSpaceArchive):
+        self._archive: StateSpaceArchive = archive
+        self._staging_dir: str = f"{archive.path}.staging"
+
+    @property
+    def staging_dir(self) -> str:
+        return self._staging_dir
+
+    def start(self):
+        # entries staged by an interrupted batch were never recorded as completed, their tasks are run again
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+        os.makedirs(self._staging_dir)
+
+    def stage(self, key: str, state_space: StateSpace) -> str:
+        """Writes the entry of the state space to a new file of the staging directory and returns its path."""
+        state_space_json, dg_dump = dump_state_space(state_space, self._staging_dir)
+        fd, path = tempfile.mkstemp(suffix=".entry", dir=self._staging_dir)
+        with os.fdopen(fd, "wb") as f:
+            # the JSON line holds no raw newlines, the DG dump follows it
+            f.write(json.dumps({"key": key, "state_space": state_space_json}).encode() + b"\n")
+            f.write(dg_dump)
+            f.flush()
+            os.fsync(f.fileno())
+
+        return path
+
+    def commit(self, path: str):
+        """Appends the entry staged in `path` to the archive and removes the file."""
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            dg_dump = f.read()
+
+        self._archive.append(header["key"], header["state_space"], dg_dump)
+        os.remove(path)
+
+    def close(self):
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+
+    def __enter__(self) -> 'ArchiveWriter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
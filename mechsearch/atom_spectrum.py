@@ -1,6 +1,8 @@
 import mod
+import numpy as np
 import re
-from typing import Dict, Iterable, List, Union
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 
 amino_pattern: re.Pattern = re.compile(
@@ -10,13 +12,57 @@ wildcard_pattern: re.Pattern = re.compile(r"[\s]*\*[\s]*")
 atom_label_pattern: re.Pattern = re.compile(r"[\s]*([a-zA-Z]+)[0-9+\-]*[\s]*")
 
 
+# Global element/amino/alias vocabulary shared by all spectra. Spectra are stored as count vectors indexed by this
+# vocabulary; vectors created before the vocabulary grew are zero padded on demand.
+_vocabulary: Dict[str, int] = {}
+
+
+def _element_index(element: str) -> int:
+    if element not in _vocabulary:
+        _vocabulary[element] = len(_vocabulary)
+
+    return _vocabulary[element]
+
+
+@lru_cache(maxsize=None)
+def _classify_label(label: str) -> Tuple[Optional[int], bool]:
+    """Returns the vocabulary index of the element denoted by the label and whether it is a wildcard."""
+    amino_match = amino_pattern.match(label)
+    if amino_match is not None:
+        return _element_index(f"{amino_match.group(2)}_{amino_match.group(1)}"), False
+
+    alias_match = alias_pattern.match(label)
+    if alias_match is not None:
+        return _element_index(f"ALIAS_{alias_match.group(1)}"), False
+
+    if wildcard_pattern.match(label) is not None:
+        return None, True
+
+    atom_label_match = atom_label_pattern.match(label)
+    if atom_label_match is not None:
+        return _element_index(atom_label_match.group(1)), False
+
+    return None, False
+
+
+def vocabulary_size() -> int:
+    return len(_vocabulary)
+
+
 class AtomSpectrum:
     def __init__(self, vertices: Iterable[Union[mod.Graph.Vertex, mod.Rule.LeftGraph.Vertex]]):
-        self._element_count: Dict[str, int] = dict()
+        indices: List[int] = []
         self._wildcard_atom_count: int = 0
 
         for vertex in vertices:
-            self._add_vertex(vertex)
+            index, is_wildcard = _classify_label(vertex.stringLabel)
+            if is_wildcard:
+                self._wildcard_atom_count += 1
+            elif index is not None:
+                indices.append(index)
+
+        self._counts: np.ndarray = np.bincount(np.asarray(indices, dtype=np.int64),
+                                               minlength=vocabulary_size()).astype(np.int64)
 
     def __eq__(self, other: 'AtomSpectrum') -> bool:
         return self.__le__(other) and self.__ge__(other)
@@ -34,56 +80,65 @@ class AtomSpectrum:
         return not self.__ge__(other)
 
     def __add__(self, other: 'AtomSpectrum') -> 'AtomSpectrum':
-        result = AtomSpectrum(dict())
-
-        for element, count in self._element_count.items():
-            result._add_atom(element, other.element_mass(element))
-
-        for element, count in other._element_count.items():
-            result._add_atom(element, other.element_mass(element))
-
+        result = AtomSpectrum([])
+        size = max(len(self._counts), len(other._counts))
+        result._counts = self.counts(size) + other.counts(size)
         result._wildcard_atom_count = self._wildcard_atom_count + other._wildcard_atom_count
 
         return result
 
     def __str__(self) -> str:
-        return f"{self._wildcard_atom_count} wildcards and {self._element_count}"
+        elements = {element: int(self.element_mass(element)) for element in _vocabulary if self.element_mass(element)}
+        return f"{self._wildcard_atom_count} wildcards and {elements}"
 
-    def _compute_wildcard_balance(self, other: 'AtomSpectrum') -> bool:
-        uncovered_wildcards = other._wildcard_atom_count
-        free_wildcards = self._wildcard_atom_count
-        for element, count in other._element_count.items():
-            if element in self._element_count:
-                free_wildcards -= max(0, count - self._element_count[element])
-                uncovered_wildcards -= max(0, self._element_count[element] - count)
-            else:
-                free_wildcards -= count
+    @property
+    def wildcard_atom_count(self) -> int:
+        return self._wildcard_atom_count
 
-        return uncovered_wildcards <= 0 <= free_wildcards
+    def counts(self, size: Optional[int] = None) -> np.ndarray:
+        """Returns the element counts as a vector of the given length (the current vocabulary size by default)."""
+        if size is None:
+            size = vocabulary_size()
 
-    def _add_atom(self, element: str, count: int = 1):
-        if element not in self._element_count:
-            self._element_count[element] = 0
+        if len(self._counts) >= size:
+            return self._counts[:size]
 
-        self._element_count[element] += count
+        return np.concatenate((self._counts, np.zeros(size - len(self._counts), dtype=np.int64)))
 
-    def _add_vertex(self, vertex: Union[mod.Graph.Vertex, mod.Rule.LeftGraph.Vertex]):
-        amino_match = amino_pattern.match(vertex.stringLabel)
-        if amino_match is not None:
-            self._add_atom(f"{amino_match.group(2)}_{amino_match.group(1)}")
-            return
+    def _compute_wildcard_balance(self, other: 'AtomSpectrum') -> bool:
+        counts, wildcards = AtomSpectrum.stack([other])
+        return bool(self.covers(counts, wildcards)[0])
+
+    def covers(self, counts: np.ndarray, wildcards: np.ndarray) -> np.ndarray:
+        """
+        Vectorised version of `self >= other` for every row of a stacked spectrum matrix.
+        :param counts: (n, m) element count matrix as returned by `AtomSpectrum.stack`.
+        :param wildcards: (n,) wildcard counts as returned by `AtomSpectrum.stack`.
+        :return: boolean mask of the rows covered by this spectrum.
+        """
+        own_counts = self.counts(counts.shape[1])
+        missing = np.clip(counts - own_counts, 0, None).sum(axis=1)
+        surplus = np.where(counts > 0, np.clip(own_counts - counts, 0, None), 0).sum(axis=1)
+
+        free_wildcards = self._wildcard_atom_count - missing
+        uncovered_wildcards = wildcards - surplus
+        return (uncovered_wildcards <= 0) & (free_wildcards >= 0)
 
-        alias_match = alias_pattern.match(vertex.stringLabel)
-        if alias_match is not None:
-            self._add_atom(f"ALIAS_{alias_match.lastgroup}")
+    @staticmethod
+    def stack(spectra: Sequence['AtomSpectrum']) -> Tuple[np.ndarray, np.ndarray]:
+        size = vocabulary_size()
+        counts = np.zeros((len(spectra), size), dtype=np.int64)
+        for row, spectrum in enumerate(spectra):
+            counts[row] = spectrum.counts(size)
 
-        wildcard_match = wildcard_pattern.match(vertex.stringLabel)
-        if wildcard_match is not None:
-            self._wildcard_atom_count += 1
+        wildcards = np.fromiter((spectrum._wildcard_atom_count for spectrum in spectra), dtype=np.int64,
+                                count=len(spectra))
+        return counts, wildcards
 
-        atom_label_match = atom_label_pattern.match(vertex.stringLabel)
-        if atom_label_match is not None:
-            self._add_atom(atom_label_match.lastgroup)
+    @staticmethod
+    def is_empty(counts: np.ndarray, wildcards: np.ndarray) -> np.ndarray:
+        """Vectorised version of `AtomSpectrum({}) >= other` for every row of a stacked spectrum matrix."""
+        return (counts.sum(axis=1) == 0) & (wildcards <= 0)
 
     @staticmethod
     def from_graph(graph: mod.Graph) -> 'AtomSpectrum':
@@ -102,7 +157,7 @@ class AtomSpectrum:
         return AtomSpectrum(rule.left.vertices)
 
     def element_mass(self, element: str):
-        if element not in self._element_count:
+        if element not in _vocabulary or _vocabulary[element] >= len(self._counts):
             return 0
 
-        return self._element_count[element]
+        return self._counts[_vocabulary[element]]
@@ -0,0 +1,301 @@
+from mechsearch.grammar import Grammar
+from mechsearch.graph import Rule
+from mechsearch.state_space import StateSpace, StateSpaceEdge, StateSpaceNode, Path
+from mechsearch.state_space_index import StateSpaceIndex
+import mod
+from collections import deque
+import networkx as nx
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+class Constraint:
+    """
+    Deterministic automaton over the transitions of a mechanism. A mechanism satisfies the constraint if stepping
+    through its transitions from `initial` never rejects (returns `None`) and ends in an accepting state.
+    Constraint states must be hashable and should be kept few, as the search runs over their product with the states.
+    """
+
+    @property
+    def initial(self) -> Hashable:
+        """The constraint state before the first transition."""
+        pass
+
+    def step(self, state: Hashable, transition: mod.DGHyperEdge) -> Optional[Hashable]:
+        """The constraint state after the transition, or `None` if the mechanism is rejected."""
+        pass
+
+    def accepting(self, state: Hashable) -> bool:
+        """Whether a mechanism ending in the constraint state satisfies the constraint."""
+        pass
+
+
+class UsesAminoAcid(Constraint):
+    """The mechanism has a transition consuming an amino acid molecule."""
+
+    def __init__(self):
+        self._uses_amino: Dict[mod.DGHyperEdge, bool] = {}
+
+    @property
+    def initial(self) -> bool:
+        return False
+
+    def _transition_uses_amino(self, transition: mod.DGHyperEdge) -> bool:
+        if transition not in self._uses_amino:
+            self._uses_amino[transition] = any(vertex.stringLabel.startswith("Amino") for
+                                               source in transition.sources for vertex in source.graph.vertices)
+
+        return self._uses_amino[transition]
+
+    def step(self, state: bool, transition: mod.DGHyperEdge) -> bool:
+        return state or self._transition_uses_amino(transition)
+
+    def accepting(self, state: bool) -> bool:
+        return state
+
+
+class UsesDistinctMCSAEntries(Constraint):
+    """
+    The mechanism uses rules derived from at least `minimum` different MCSA entries. The state is the set of entries
+    used so far, which collapses to `True` once `minimum` entries have been seen.
+    """
+
+    def __init__(self, grammar: Grammar, minimum: int = 2):
+        self._rules: Dict[mod.Rule, Rule] = {rule.rule: rule for rule in grammar.rules}
+        self._minimum: int = minimum
+        self._entries: Dict[mod.DGHyperEdge, FrozenSet[int]] = {}
+
+    @property
+    def initial(self):
+        return True if self._minimum <= 0 else frozenset()
+
+    def _transition_entries(self, transition: mod.DGHyperEdge) -> FrozenSet[int]:
+        if transition not in self._entries:
+            self._entries[transition] = frozenset(step.entry for rule in transition.rules if rule in self._rules
+                                                  for step in self._rules[rule].steps)
+
+        return self._entries[transition]
+
+    def step(self, state, transition: mod.DGHyperEdge):
+        if state is True:
+            return True
+
+        entries = state | self._transition_entries(transition)
+        return True if len(entries) >= self._minimum else entries
+
+    def accepting(self, state) -> bool:
+        return state is True
+
+
+class NeverUsesRule(Constraint):
+    """The mechanism does not use any of the given rules."""
+
+    def __init__(self, rules: Iterable[Rule]):
+        self._forbidden: Set[mod.Rule] = {rule.rule for rule in rules}
+
+    @property
+    def initial(self) -> bool:
+        return True
+
+    def step(self, state: bool, transition: mod.DGHyperEdge) -> Optional[bool]:
+        if any(rule in self._forbidden for rule in transition.rules):
+            return None
+
+        return state
+
+    def accepting(self, state: bool) -> bool:
+        return True
+
+
+class AllOf(Constraint):
+    """Conjunction of constraints, the state is the tuple of their states."""
+
+    def __init__(self, *constraints: Constraint):
+        self._constraints: Tuple[Constraint, ...] = constraints
+
+    @property
+    def initial(self) -> Tuple[Hashable, ...]:
+        return tuple(constraint.initial for constraint in self._constraints)
+
+    def step(self, state: Tuple[Hashable, ...], transition: mod.DGHyperEdge) -> Optional[Tuple[Hashable, ...]]:
+        next_state: List[Hashable] = []
+        for constraint, constraint_state in zip(self._constraints, state):
+            constraint_state = constraint.step(constraint_state, transition)
+            if constraint_state is None:
+                return None
+            next_state.append(constraint_state)
+
+        return tuple(next_state)
+
+    def accepting(self, state: Tuple[Hashable, ...]) -> bool:
+        return all(constraint.accepting(constraint_state) for
+                   constraint, constraint_state in zip(self._constraints, state))
+
+
+class ConstrainedNode(StateSpaceNode):
+    def __init__(self, id: int, base: StateSpaceNode, constraint_state: Hashable):
+        super().__init__(id, base.state)
+        self._base: StateSpaceNode = base
+        self._constraint_state: Hashable = constraint_state
+
+    def __str__(self) -> str:
+        return f"Node ID: {self.id} ({self._base.id}, {self._constraint_state});\t{self.state}"
+
+    @property
+    def base(self) -> StateSpaceNode:
+        return self._base
+
+    @property
+    def constraint_state(self) -> Hashable:
+        return self._constraint_state
+
+
+class ConstrainedStateSpace:
+    """
+    Product of a frozen state space with a constraint automaton. Nodes are pairs of a state and a constraint state,
+    and an edge between two nodes carries the transitions of the underlying edge that lead from the one constraint
+    state to the other. All pairs of the target with an accepting constraint state are merged into a single target
+    node, and only nodes from which that target is reachable are kept. Hence every path from the initial to the
+    target node is a mechanism satisfying the constraint, and the searches and samplers working on frozen state
+    spaces can be run directly on the product. `get_path` maps product paths back to paths of the underlying state
+    space restricted to the qualifying transitions.
+
+    As in the underlying state space, paths end at the first visit of the target. A product path may however visit
+    the same state twice with different constraint states.
+    """
+
+    def __init__(self, state_space: StateSpace, constraint: Constraint):
+        if not state_space.is_frozen():
+            raise ValueError("ConstrainedStateSpace requires a frozen state space")
+
+        self._state_space: StateSpace = state_space
+        self._constraint: Constraint = constraint
+        self._graph = nx.DiGraph()
+        self._index: Optional[StateSpaceIndex] = None
+
+        nodes: Dict[Tuple[StateSpaceNode, Hashable], ConstrainedNode] = {}
+
+        def get_node(base: StateSpaceNode, constraint_state: Hashable) -> ConstrainedNode:
+            key = (base, constraint_state)
+            if key not in nodes:
+                nodes[key] = ConstrainedNode(len(nodes), base, constraint_state)
+                self._graph.add_node(nodes[key])
+            return nodes[key]
+
+        base_target = state_space.target_node
+        self._initial_node: ConstrainedNode = get_node(state_space.initial_node, constraint.initial)
+        # the constraint state of the merged target is irrelevant, `None` never occurs as a constraint state
+        self._target_node: ConstrainedNode = get_node(base_target, None)
+
+        queue = deque([self._initial_node])
+        while queue:
+            node = queue.popleft()
+            if node.base == base_target:
+                continue
+
+            for edge in state_space.expand_node(node.base):
+                for transition in edge.transitions:
+                    constraint_state = constraint.step(node.constraint_state, transition)
+                    if constraint_state is None:
+                        continue
+
+                    if edge.target == base_target and constraint.accepting(constraint_state):
+                        target = self._target_node
+                    else:
+                        is_new = (edge.target, constraint_state) not in nodes
+                        target = get_node(edge.target, constraint_state)
+                        if is_new:
+                            queue.append(target)
+
+                    if self._graph.has_edge(node, target):
+                        self._graph.edges[node, target]["edge"].add_transition(transition)
+                    else:
+                        self._graph.add_edge(node, target, edge=StateSpaceEdge(node, target, {transition}))
+
+        basin: Set[ConstrainedNode] = {self._target_node}
+        stack = [self._target_node]
+        while stack:
+            node = stack.pop()
+            for source, _ in self._graph.in_edges(node):
+                if source not in basin:
+                    basin.add(source)
+                    stack.append(source)
+
+        self._graph.remove_nodes_from([node for node in list(self._graph.nodes) if
+                                       node not in basin and node != self._initial_node])
+
+    @property
+    def base_state_space(self) -> StateSpace:
+        return self._state_space
+
+    @property
+    def constraint(self) -> Constraint:
+        return self._constraint
+
+    @property
+    def grammar(self) -> Grammar:
+        return self._state_space.grammar
+
+    @property
+    def graph(self) -> nx.DiGraph:
+        return self._graph
+
+    @property
+    def initial_node(self) -> ConstrainedNode:
+        return self._initial_node
+
+    @property
+    def target_node(self) -> ConstrainedNode:
+        return self._target_node
+
+    @property
+    def number_of_states(self) -> int:
+        return len(self._graph)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self._graph.edges)
+
+    @property
+    def expanded_nodes(self) -> Set[ConstrainedNode]:
+        return set(self._graph.nodes)
+
+    @property
+    def index(self) -> StateSpaceIndex:
+        if self._index is None:
+            self._index = StateSpaceIndex(self)
+
+        return self._index
+
+    def count_paths(self, max_length: int, simple: bool = False,
+                    max_expansions: Optional[int] = None) -> Dict[int, int]:
+        if simple:
+            return self.index.count_simple_paths(max_length, max_expansions)
+
+        return self.index.count_paths(max_length)
+
+    def edges(self):
+        for source, target in self._graph.edges:
+            yield self.get_edge(source, target)
+
+    def freeze(self):
+        pass
+
+    def is_frozen(self):
+        return True
+
+    def expand_node(self, node: ConstrainedNode, inverse: bool = False, verbosity: int = 0) -> Iterable[StateSpaceEdge]:
+        edges = self._graph.edges if not inverse else self._graph.in_edges
+        for (source, target) in edges(node):
+            yield self.get_edge(source, target)
+
+    def get_edge(self, source: ConstrainedNode, target: ConstrainedNode) -> StateSpaceEdge:
+        return self._graph.edges[source, target]["edge"]
+
+    def get_path(self, nodes: List[ConstrainedNode]) -> Path:
+        return Path([StateSpaceEdge(node.base, nodes[index + 1].base,
+                                    self.get_edge(node, nodes[index + 1]).transitions) for
+                     index, node in enumerate(nodes[:-1])])
+
+    def __str__(self) -> str:
+        return f"ConstrainedStateSpace(|V|={self.number_of_states}, |E|={self.num_edges}, " \
+               f"BASE={self._state_space})"
@@ -1,8 +1,9 @@
 import mod
 from mechsearch.grammar import Grammar
-from mechsearch.graph import Rule, GraphMultiset
+from mechsearch.graph import Graph, GraphMultiset, Rule
 from mechsearch.rule_canonicalisation import CanonSmilesRule
-from typing import List, Dict
+from mechsearch.rule_index import RuleIndex
+from typing import Dict, Iterable, List, Set, Tuple
 
 
 def make_inverse_derivation(edge: mod.DGHyperEdge, inverse_rule: mod.Rule):
@@ -74,7 +75,9 @@ class DGExpander:
             assert(len(ders) == len(ders_temp))
             return ders
 
-        inverse_edges = self._ddg_inverse.apply(graphs)
+        return self._invert(self._ddg_inverse.apply(graphs))
+
+    def _invert(self, inverse_edges: Iterable[mod.DGHyperEdge]) -> List[mod.DGHyperEdge]:
         edges = []
         for e in inverse_edges:
             ir = None
@@ -109,3 +112,69 @@ class DGExpander:
     @property
     def derivation_graph(self):
         return self._dg
+
+
+class SharedDGExpander(DGExpander):
+    """
+    Expander for exploring the state spaces of several amino acid combinations of the same reaction. Molecules
+    containing an amino acid vertex are amino dependent. The derivations of a multiset are split into those among its
+    amino independent molecules, which are memoised by that sub-multiset and hence shared by every combination and
+    every state with the same amino independent molecules, and those using an amino dependent molecule. The latter are
+    the proper derivations, i.e., derivations using exactly the molecules, of every sub-multiset containing an amino
+    dependent molecule, which are memoised per sub-multiset as well. Both parts together are exactly the derivations
+    computed by `DGExpander`.
+    """
+
+    def __init__(self, grammar: Grammar, use_filtered: bool = True):
+        super().__init__(grammar, use_filtered)
+        self._rule_index: RuleIndex = RuleIndex(self._rules)
+        self._inverse_rule_index: RuleIndex = RuleIndex(self._inverse_rules)
+        self._max_left_components: int = max((rule.rule.numLeftComponents for rule in self._rules), default=0)
+        self._max_inverse_left_components: int = max((rule.rule.numLeftComponents for
+                                                      rule in self._inverse_rules), default=0)
+
+        self._is_amino_dependent: Dict[int, bool] = {}
+        self._derivations: Dict[Tuple[GraphMultiset, bool], List[mod.DGHyperEdge]] = {}
+        self._proper_derivations: Dict[Tuple[GraphMultiset, bool], List[mod.DGHyperEdge]] = {}
+
+    def _amino_dependent(self, graph: Graph) -> bool:
+        if graph.id not in self._is_amino_dependent:
+            self._is_amino_dependent[graph.id] = any(vertex.stringLabel.startswith("Amino") for
+                                                     vertex in graph.graph.vertices)
+
+        return self._is_amino_dependent[graph.id]
+
+    def _proper(self, graph_multiset: GraphMultiset, inverse: bool) -> List[mod.DGHyperEdge]:
+        key = (graph_multiset, inverse)
+        if key not in self._proper_derivations:
+            rule_index = self._rule_index if not inverse else self._inverse_rule_index
+            graphs = [g.graph for g in graph_multiset.graphs]
+            edges: Set[mod.DGHyperEdge] = set()
+            for rule in rule_index.candidates(graph_multiset.atom_spectrum):
+                # every molecule must be matched by a connected component of the left side
+                if rule.rule.numLeftComponents < len(graph_multiset):
+                    continue
+                edges.update(self._builder.apply(graphs, rule.rule, onlyProper=True))
+
+            self._proper_derivations[key] = list(edges) if not inverse else self._invert(edges)
+
+        return self._proper_derivations[key]
+
+    def compute_derivations(self, graph_multiset: GraphMultiset, inverse: bool = False, verbosity: int = 0):
+        independent = GraphMultiset({graph: count for graph, count in graph_multiset.counter.items() if
+                                     not self._amino_dependent(graph)})
+
+        derivations: Set[mod.DGHyperEdge] = set()
+        if len(independent) > 0:
+            key = (independent, inverse)
+            if key not in self._derivations:
+                self._derivations[key] = list(super().compute_derivations(independent, inverse, verbosity))
+            derivations.update(self._derivations[key])
+
+        if len(independent) < len(graph_multiset):
+            maximum_size = self._max_left_components if not inverse else self._max_inverse_left_components
+            for sub_multiset in graph_multiset.sub_multisets(maximum_size):
+                if len(sub_multiset) > 0 and any(self._amino_dependent(graph) for graph in sub_multiset.graphs):
+                    derivations.update(self._proper(sub_multiset, inverse))
+
+        return derivations
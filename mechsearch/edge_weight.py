@@ -3,6 +3,13 @@ from typing import Dict, Tuple
 
 
 class EdgeWeight:
+    # declares whether integer source weights are mapped to integer weights, see `make_priority_queue`
+    integral: bool = False
+    # declares whether `weight(w, edge) == w + weight(0, edge)`, i.e., the weight of a path is the sum of edge costs
+    additive: bool = False
+    # declares that every edge costs 1, i.e., the weight of a path is its number of edges, see `explore.is_unit_cost`
+    unit_cost: bool = False
+
     def __init__(self):
         self._cache: Dict[Tuple[float, StateSpaceEdge], float] = dict()
 
@@ -17,6 +24,10 @@ class EdgeWeight:
 
 
 class ConstantEdgeWeight(EdgeWeight):
+    integral: bool = True
+    additive: bool = True
+    unit_cost: bool = True
+
     def __init__(self):
         super().__init__()
 
@@ -1,8 +1,9 @@
 from mechsearch.state_space import StateSpace, StateSpaceNode
 from mechsearch.grammar import Grammar
 from mechsearch.explore import bidirectional_bfs
-from mechsearch.dg_expander import DGExpander
-from typing import List, Set
+from mechsearch.dg_expander import DGExpander, SharedDGExpander
+from mechsearch.result_cache import StateSpaceCache, state_space_key
+from typing import List, Optional, Set
 import mod
 import itertools
 
@@ -35,9 +36,32 @@ def compute_state_space(grammar: Grammar,
                         amino_db: List[mod.Graph],
                         max_depth: int,
                         max_used_aminos: int = 1,
-                        verbose: bool = False):
+                        verbose: bool = False,
+                        shared: bool = True,
+                        cache: Optional[StateSpaceCache] = None):
+    """
+    Computes the union of the pruned state spaces of the reaction together with every combination of
+    `max_used_aminos` amino acids.
+    :param shared: share the derivations among the amino independent molecules, and the derivations of amino
+        dependent sub-multisets, across all states and combinations (see `SharedDGExpander`). The resulting state
+        space is the same.
+    :param cache: if given, the state space is loaded from the cache when it has been computed before, and stored in
+        it otherwise.
+    """
+    key: Optional[str] = None
+    if cache is not None:
+        # the rule fingerprint serialises every rule, so the key is only computed when it is used
+        key = state_space_key((graph.graph for graph in grammar.initial_multiset.graphs),
+                              (graph.graph for graph in grammar.target_multiset.graphs), amino_db,
+                              grammar.rule_fingerprint, max_depth,
+                              {"function": "enzyme_planner.compute_state_space", "max_used_aminos": max_used_aminos})
     grammar.append_graphs(amino_db)
-    dg_expander = DGExpander(grammar, False)
+    if cache is not None:
+        cached_state_space = cache.load(key, grammar)
+        if cached_state_space is not None:
+            return cached_state_space
+
+    dg_expander = SharedDGExpander(grammar, False) if shared else DGExpander(grammar, False)
     full_state_space = StateSpace(grammar, dg_expander)
     for aminos in itertools.combinations(amino_db, max_used_aminos):
         if verbose:
@@ -54,4 +78,6 @@ def compute_state_space(grammar: Grammar,
         del state_space
 
     print("FULL STATE SPACE:", full_state_space.number_of_states)
+    if cache is not None:
+        cache.store(key, full_state_space)
     return full_state_space
@@ -1,15 +1,35 @@
+from mechsearch.heuristic import Heuristic, MoleculeBalanceHeuristic
+from mechsearch.priority_queue import make_priority_queue
 from mechsearch.state import State
-from mechsearch.state_space import StateSpace, StateSpaceNode, Path
-from collections import deque
+from mechsearch.state_space import StateSpace, StateSpaceEdge, StateSpaceNode, Path
+import mod
+from collections import deque, OrderedDict
+import functools
 import heapq
 import itertools
-from typing import Set, List
+from typing import Callable, Dict, Set, List, Optional
 
 
 def equal_weights(w: float, transition):
     return w + 1
 
 
+equal_weights.integral = True
+equal_weights.additive = True
+equal_weights.unit_cost = True
+
+
+def is_additive(weight) -> bool:
+    """Whether the weight function declares that path weights are sums of edge costs, see `EdgeWeight.additive`."""
+    return bool(getattr(weight, "additive", False))
+
+
+def is_unit_cost(weight) -> bool:
+    """Whether the weight function declares that the weight of a path is its number of edges."""
+    return is_additive(weight) and bool(getattr(weight, "integral", False)) and \
+        bool(getattr(weight, "unit_cost", False))
+
+
 def compute_state_space(state_space: StateSpace):
     source = state_space.initial_node
 
@@ -25,7 +45,7 @@ def compute_state_space(state_space: StateSpace):
                 Q.append(w.target)
 
 
-def dfs(state_space: StateSpace, weight=equal_weights, max_len=None):
+def dfs(state_space: StateSpace, weight=equal_weights, max_len=None, verbose: bool = False):
     source = state_space.initial_node
     target = state_space.target_node
 
@@ -54,9 +74,8 @@ def dfs(state_space: StateSpace, weight=equal_weights, max_len=None):
         transitions = list(state_space.expand_node(v))
         transitions.sort(key=lambda transition: -weight(0, transition))
 
-        print("EXPANDED: ", state_space.number_of_expanded_states, "TOTAL STATES:", state_space.number_of_states)
-        #if state_space.number_of_states > 100:
-            #return
+        if verbose:
+            print("EXPANDED: ", state_space.number_of_expanded_states, "TOTAL STATES:", state_space.number_of_states)
         for transition in transitions:
             if transition.target not in visited_states and transition.target.state != target.state:
                 stack.append(transition.target)
@@ -68,6 +87,105 @@ def dfs(state_space: StateSpace, weight=equal_weights, max_len=None):
                 path.pop()
 
 
+class TranspositionTable:
+    """
+    Bounded table mapping states to the largest number of remaining steps within which the target is known to be
+    unreachable from them. The least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size: int = max_size
+        self._table: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def is_dead_end(self, state: State, remaining: int) -> bool:
+        if state not in self._table:
+            return False
+
+        self._table.move_to_end(state)
+        return self._table[state] >= remaining
+
+    def record_dead_end(self, state: State, remaining: int):
+        self._table[state] = max(remaining, self._table.get(state, 0))
+        self._table.move_to_end(state)
+        if len(self._table) > self._max_size:
+            self._table.popitem(last=False)
+
+
+def _depth_limited_paths(state_space: StateSpace, v: State, target: State, remaining: int, path: List[State],
+                         transitions: List[Set[mod.DGHyperEdge]], on_path: Set[State], table: TranspositionTable):
+    # yields the simple paths reaching the target in exactly `remaining` steps and returns whether the target is
+    # reachable within `remaining` steps and whether the search was cut short by states already on the path
+    if remaining == 0 or table.is_dead_end(v, remaining):
+        return False, False
+
+    found, blocked = False, False
+    for w, w_transitions in state_space.successors(v).items():
+        if w == target:
+            found = True
+            if remaining == 1:
+                # only the paths found are added to the state space
+                path.append(w)
+                transitions.append(w_transitions)
+                yield Path([state_space.add_transitions(path[index], path[index + 1], transitions[index]) for
+                            index in range(len(transitions))])
+                path.pop()
+                transitions.pop()
+            continue
+
+        if w in on_path:
+            blocked = True
+            continue
+
+        path.append(w)
+        transitions.append(w_transitions)
+        on_path.add(w)
+        w_found, w_blocked = yield from _depth_limited_paths(state_space, w, target, remaining - 1, path,
+                                                             transitions, on_path, table)
+        path.pop()
+        transitions.pop()
+        on_path.remove(w)
+        found, blocked = found or w_found, blocked or w_blocked
+
+    # a failure is only a property of the state if no branch was pruned because of the current path
+    if not found and not blocked:
+        table.record_dead_end(v, remaining)
+
+    return found, blocked
+
+
+def iterative_deepening_dfs(state_space: StateSpace, max_length: int, table_size: int = 100000,
+                            verbose: bool = False):
+    """
+    Enumerates every simple path of length at most `max_length` from the initial to the target node, in order of
+    increasing length. Each iteration is a depth-first search bounded by the current length over the successors
+    of the states (see `StateSpace.successors`), so the search itself only keeps the current path and a bounded
+    transposition table of states from which the target was found to be unreachable within a number of steps.
+    Only the states and transitions of the enumerated paths are added to the state space. The derivation graph
+    still records every derivation computed, and the successors of a state are recomputed from it whenever the
+    state is visited again.
+
+    :param state_space: the state space to explore.
+    :param max_length: the maximal length of the enumerated paths.
+    :param table_size: the maximal number of states kept in the transposition table.
+    :param verbose: print the number of paths found in each iteration.
+    """
+    source = state_space.initial_node.state
+    target = state_space.target_node.state
+    table = TranspositionTable(table_size)
+    for length in range(1, max_length + 1):
+        number_of_paths = 0
+        for path in _depth_limited_paths(state_space, source, target, length, [source], [], {source}, table):
+            number_of_paths += 1
+            yield path
+
+        if verbose:
+            print(f"\tDEPTH {length}: {number_of_paths} paths, STATES: {state_space.number_of_states}, "
+                  f"TABLE: {len(table)}")
+
+
 def _bfs(state_space: StateSpace, source: StateSpaceNode,
          target: StateSpaceNode,
          inverse: bool, max_length: int,
@@ -118,6 +236,157 @@ def bidirectional_bfs(state_space: StateSpace,
     _bfs(state_space, target, source, True, backward_max_length, verbose)
 
 
+class MeetInTheMiddleStatistics:
+    def __init__(self, max_length: int):
+        self.max_length: int = max_length
+        self.meetings: Dict[StateSpaceNode, int] = {}
+        self.depths: List[int] = [0, 0]
+        self.expanded: List[Set[StateSpaceNode]] = [set(), set()]
+        # see `meet_in_the_middle_bfs`
+        self.estimated_saved_expansions: int = 0
+
+    @property
+    def shortest_length(self) -> Optional[int]:
+        return min(self.meetings.values()) if self.meetings else None
+
+    @property
+    def number_of_expansions(self) -> int:
+        return len(self.expanded[0]) + len(self.expanded[1])
+
+    def __str__(self) -> str:
+        return f"MeetInTheMiddle(meetings={len(self.meetings)}, shortest={self.shortest_length}, " \
+               f"depths={tuple(self.depths)}, expansions=({len(self.expanded[0])}, {len(self.expanded[1])}), " \
+               f"saved~{self.estimated_saved_expansions})"
+
+
+def meet_in_the_middle_bfs(state_space: StateSpace,
+                           max_length: int,
+                           stop_at_first_meeting: bool = False,
+                           verbose: bool = False) -> MeetInTheMiddleStatistics:
+    """
+    Bidirectional BFS that alternates between the forward and backward search, always extending the smaller
+    frontier by one layer, until the depths of the two searches sum to `max_length`. As with `bidirectional_bfs`,
+    every path of length at most `max_length` between the initial and target node is contained in the explored
+    state space, unless the search is stopped at the first meeting of the two frontiers.
+
+    :param state_space: the state space to explore.
+    :param max_length: the maximal length of the paths to explore.
+    :param stop_at_first_meeting: stop as soon as a layer reaches a node seen by the opposite search, i.e.,
+        once a shortest path has been found.
+    :param verbose: print the progress of each layer.
+    :return: the meeting nodes with the lengths of the shortest paths through them, and an estimate of the number
+        of expansions saved compared to the two-pass `bidirectional_bfs`: the nodes within the depths of the two-pass
+        searches that were reached but not expanded, minus the nodes expanded beyond those depths. It is not a bound,
+        the two-pass searches may also expand nodes that were never reached here.
+    """
+    ends = [state_space.initial_node, state_space.target_node]
+    depths: List[Dict[StateSpaceNode, int]] = [{ends[0]: 0}, {ends[1]: 0}]
+    frontiers: List[List[StateSpaceNode]] = [[ends[0]], [ends[1]]]
+    statistics = MeetInTheMiddleStatistics(max_length)
+    if ends[0] == ends[1]:
+        statistics.meetings[ends[0]] = 0
+
+    while sum(statistics.depths) < max_length and not (stop_at_first_meeting and statistics.meetings):
+        directions = [direction for direction in (0, 1) if frontiers[direction]]
+        if not directions:
+            break
+
+        direction = min(directions, key=lambda d: len(frontiers[d]))
+        inverse = direction == 1
+        if verbose:
+            print(f"\tLAYER {statistics.depths[direction] + 1} (inverse={inverse}, N = {len(frontiers[direction])})")
+
+        next_frontier: List[StateSpaceNode] = []
+        for v in frontiers[direction]:
+            if v == ends[1 - direction]:
+                continue
+
+            statistics.expanded[direction].add(v)
+            for edge in state_space.expand_node(v, inverse=inverse):
+                w = edge.source if inverse else edge.target
+                if w in depths[direction]:
+                    continue
+
+                depths[direction][w] = statistics.depths[direction] + 1
+                next_frontier.append(w)
+                if w in depths[1 - direction]:
+                    statistics.meetings[w] = depths[0][w] + depths[1][w]
+
+        frontiers[direction] = next_frontier
+        statistics.depths[direction] += 1
+
+    two_pass_lengths = [int(max_length/2) + max_length%2, int(max_length/2)]
+    saved = sum(1 for direction in (0, 1) for v, depth in depths[direction].items() if
+                depth < two_pass_lengths[direction] and v != ends[1 - direction] and
+                v not in statistics.expanded[direction])
+    extra = sum(1 for direction in (0, 1) for v in statistics.expanded[direction] if
+                depths[direction][v] >= two_pass_lengths[direction])
+    statistics.estimated_saved_expansions = saved - extra
+    if verbose:
+        print(statistics)
+
+    return statistics
+
+
+def beam_search(state_space: StateSpace,
+                beam_width: int,
+                max_length: int,
+                score: Optional[Callable[[StateSpaceNode], float]] = None,
+                inverse: bool = False,
+                verbose: bool = False) -> bool:
+    """
+    Layered search that only keeps the `beam_width` best scoring nodes of every layer. Nodes added by the search
+    outside the beam are removed from the state space again, so it grows by O(beam_width * max_length) nodes, while
+    nodes that existed before are kept. The MOD derivation graph cannot shrink and still records every derivation
+    of the expanded nodes. The search is incomplete: mechanisms through discarded nodes are lost.
+
+    :param state_space: the state space to explore.
+    :param beam_width: the number of nodes kept per layer.
+    :param max_length: the number of layers to explore.
+    :param score: scoring function where lower is better. Defaults to the `MoleculeBalanceHeuristic` distance to
+        the opposite end of the search.
+    :param inverse: search backwards from the target node.
+    :param verbose: print the size of each layer.
+    :return: whether the opposite end of the search was reached.
+    """
+    start, end = state_space.initial_node, state_space.target_node
+    if inverse:
+        start, end = end, start
+
+    if score is None:
+        heuristic = MoleculeBalanceHeuristic.from_grammar(state_space.grammar)
+        goal = end.state.graph_multiset
+        score = lambda node: heuristic(node.state, goal, inverse)
+
+    # only nodes the search adds are pruned, a partially explored or shared state space keeps its nodes
+    existing: Set[StateSpaceNode] = set(state_space.graph.nodes)
+    kept: Set[StateSpaceNode] = {start, end}
+    beam: List[StateSpaceNode] = [start]
+    found = False
+    for length in range(1, max_length + 1):
+        candidates: Dict[StateSpaceNode, None] = {}
+        for v in beam:
+            for edge in state_space.expand_node(v, inverse=inverse):
+                w = edge.source if inverse else edge.target
+                if w == end:
+                    found = True
+                elif w not in kept:
+                    candidates[w] = None
+
+        beam = heapq.nsmallest(beam_width, candidates, key=score)
+        kept.update(beam)
+        state_space.remove_nodes([w for w in candidates if w not in kept and w not in existing])
+
+        if verbose:
+            print(f"\tLAYER {length}: kept {len(beam)} of {len(candidates)} new nodes, "
+                  f"TOTAL STATES: {state_space.number_of_states}")
+
+        if not beam:
+            break
+
+    return found
+
+
 # Most of the algorithm has been copied from NetworkX
 def _bidirectional_dijkstra(state_space: StateSpace,
                             source: StateSpaceNode,
@@ -127,42 +396,33 @@ def _bidirectional_dijkstra(state_space: StateSpace,
                             ignore_edges=None,
                             expansion_limit=0,
                             verbosity=0):
-    push = heapq.heappush
-    pop = heapq.heappop
-
     # Init:   Forward             Backward
     dists = [{}, {}]  # dictionary of final distances
-    paths = [{source: [source]}, {target: [target]}]  # dictionary of paths
-    fringe = [[], []]  # heap of (distance, node) tuples for
-    # extracting next node to expand
+    preds = [{source: None}, {target: None}]  # dictionary of predecessors, the path is only built at the end
+    fringe = [make_priority_queue(weight), make_priority_queue(weight)]  # queues of nodes to expand
     seen = [{source: 0}, {target: 0}]  # dictionary of distances to
     # nodes seen
-    c = itertools.count()
-    # initialize fringe heap
-    push(fringe[0], (0, next(c), source))
-    push(fringe[1], (0, next(c), target))
-    
+    fringe[0].push(source, 0)
+    fringe[1].push(target, 0)
+
     # variables to hold shortest discovered path
     finaldist = 1e30000
-    finalpath = []
+    finalnode = None
     dir = 1
     while fringe[0] and fringe[1]:
         # choose direction
         # dir == 0 is forward direction and dir == 1 is back
         dir = 1 - dir
 
-        # extract closest to expand
-        (dist, _, v) = pop(fringe[dir])
-        if v in dists[dir]:
-            # Shortest path to v has already been found
-            continue
+        # extract closest to expand, the queues decrease keys so every node is popped at most once
+        (dist, v) = fringe[dir].pop()
 
         # update distance
         dists[dir][v] = dist  # equal to seen[dir][v]
         if v in dists[1 - dir]:
             # if we have scanned v in both directions we are done
             # we have now discovered the shortest path
-            return (finaldist, finalpath)
+            break
 
         for edge in state_space.expand_node(v, inverse=(dir == 1), verbosity=verbosity):
             w = edge.target if dir == 0 else edge.source
@@ -177,43 +437,35 @@ def _bidirectional_dijkstra(state_space: StateSpace,
             elif w not in seen[dir] or vwLength < seen[dir][w]:
                 # relaxing
                 seen[dir][w] = vwLength
-                push(fringe[dir], (vwLength, next(c), w))
-                paths[dir][w] = paths[dir][v] + [w]
+                fringe[dir].push(w, vwLength)
+                preds[dir][w] = v
                 if w in seen[0] and w in seen[1]:
                     # see if this path is better than than the already
                     # discovered shortest path
                     totaldist = seen[0][w] + seen[1][w]
-                    if finalpath == [] or finaldist > totaldist:
+                    if finalnode is None or finaldist > totaldist:
                         finaldist = totaldist
-                        revpath = paths[1][w][:]
-                        revpath.reverse()
-                        finalpath = paths[0][w] + revpath[1:]
-    return None, None
+                        finalnode = w
+
+    if finalnode is None:
+        return None, None
+
+    revpath = _reconstruct_path(preds[1], finalnode)
+    revpath.reverse()
+    return finaldist, _reconstruct_path(preds[0], finalnode) + revpath[1:]
 
 
 def _dijkstra(state_space: StateSpace, source: StateSpaceNode, target: StateSpaceNode, weight, ignore_nodes = None,
               ignore_edges = None, expansion_limit: int = 0, verbosity: int = 0) -> (float, Path):
-    push = heapq.heappush
-    pop = heapq.heappop
     used = set()
     dists = {source: 0}
     prev = {source: None}
-    c = itertools.count()
-    fringe = []
-    push(fringe, (0, next(c), source))
+    fringe = make_priority_queue(weight)
+    fringe.push(source, 0)
     while fringe:
-        dist, _, v = pop(fringe)
-        if v is None or v in used:
-            continue
-
+        dist, v = fringe.pop()
         if v == target:
-            path: List[StateSpaceNode] = []
-            prev_node = v
-            while prev_node is not None:
-                path.append(prev_node)
-                prev_node = prev[prev_node]
-            path.reverse()
-            return dist, path
+            return dist, _reconstruct_path(prev, v)
 
         used.add(v)
         for edge in state_space.expand_node(v, verbosity=verbosity):
@@ -222,12 +474,15 @@ def _dijkstra(state_space: StateSpace, source: StateSpaceNode, target: StateSpac
 
             assert(v == edge.source)
 
+            if edge.target in used:
+                continue
+
             alt = weight(dist, edge)
             if edge.target not in dists or alt < dists[edge.target]:
                 dists[edge.target] = alt
                 # assert (prev[edge.source] is None or prev[edge.source] != edge.target)
                 prev[edge.target] = edge.source
-                push(fringe, (alt, next(c), edge.target))
+                fringe.push(edge.target, alt)
 
         if expansion_limit and len(state_space.expanded_nodes) >= expansion_limit:
             break
@@ -235,14 +490,137 @@ def _dijkstra(state_space: StateSpace, source: StateSpaceNode, target: StateSpac
     return None, None
 
 
+def _reconstruct_path(prev, node) -> List[StateSpaceNode]:
+    path: List[StateSpaceNode] = []
+    while node is not None:
+        path.append(node)
+        node = prev[node]
+    path.reverse()
+    return path
+
+
+def _astar(state_space: StateSpace, source: StateSpaceNode, target: StateSpaceNode, weight, heuristic: Heuristic,
+           ignore_nodes=None, ignore_edges=None, expansion_limit: int = 0, verbosity: int = 0) -> (float, Path):
+    push = heapq.heappush
+    pop = heapq.heappop
+    goal = target.state.graph_multiset
+    dists = {source: 0}
+    prev = {source: None}
+    c = itertools.count()
+    fringe = []
+    push(fringe, (heuristic(source.state, goal), next(c), 0, source))
+    while fringe:
+        _, _, dist, v = pop(fringe)
+        if dist > dists[v]:
+            # stale entry, v has been reached by a shorter path since it was pushed
+            continue
+
+        if v == target:
+            return dist, _reconstruct_path(prev, v)
+
+        for edge in state_space.expand_node(v, verbosity=verbosity):
+            if (ignore_nodes and edge.target in ignore_nodes) or (ignore_edges and edge in ignore_edges):
+                continue
+
+            alt = weight(dist, edge)
+            if edge.target not in dists or alt < dists[edge.target]:
+                dists[edge.target] = alt
+                prev[edge.target] = v
+                push(fringe, (alt + heuristic(edge.target.state, goal), next(c), alt, edge.target))
+
+        if expansion_limit and len(state_space.expanded_nodes) >= expansion_limit:
+            break
+
+    return None, None
+
+
+def _bidirectional_astar(state_space: StateSpace, source: StateSpaceNode, target: StateSpaceNode, weight,
+                         heuristic: Heuristic, ignore_nodes=None, ignore_edges=None, expansion_limit: int = 0,
+                         verbosity: int = 0) -> (float, Path):
+    push = heapq.heappush
+    pop = heapq.heappop
+
+    # Init:   Forward             Backward
+    goals = [target.state.graph_multiset, source.state.graph_multiset]
+    dists = [{source: 0}, {target: 0}]
+    prev = [{source: None}, {target: None}]
+    c = itertools.count()
+    fringe = [[], []]
+    push(fringe[0], (heuristic(source.state, goals[0]), next(c), 0, source))
+    push(fringe[1], (heuristic(target.state, goals[1], True), next(c), 0, target))
+
+    finaldist = 1e30000
+    meeting_node = source if source == target else None
+    if meeting_node is not None:
+        finaldist = 0
+
+    while fringe[0] and fringe[1]:
+        # with admissible heuristics no path shorter than the best one found so far is left in either direction
+        if max(fringe[0][0][0], fringe[1][0][0]) >= finaldist:
+            break
+
+        # expand the direction with the smaller fringe
+        dir = 0 if len(fringe[0]) <= len(fringe[1]) else 1
+        _, _, dist, v = pop(fringe[dir])
+        if dist > dists[dir][v]:
+            continue
+
+        for edge in state_space.expand_node(v, inverse=(dir == 1), verbosity=verbosity):
+            w = edge.target if dir == 0 else edge.source
+            if (ignore_nodes and w in ignore_nodes) or (ignore_edges and edge in ignore_edges):
+                continue
+
+            alt = weight(dist, edge)
+            if w not in dists[dir] or alt < dists[dir][w]:
+                dists[dir][w] = alt
+                prev[dir][w] = v
+                push(fringe[dir], (alt + heuristic(w.state, goals[dir], dir == 1), next(c), alt, w))
+                if w in dists[1 - dir] and alt + dists[1 - dir][w] < finaldist:
+                    finaldist = alt + dists[1 - dir][w]
+                    meeting_node = w
+
+        if expansion_limit and len(state_space.expanded_nodes) >= expansion_limit:
+            break
+
+    if meeting_node is None:
+        return None, None
+
+    backward_path = _reconstruct_path(prev[1], meeting_node)
+    backward_path.reverse()
+    return finaldist, _reconstruct_path(prev[0], meeting_node) + backward_path[1:]
+
+
+def _path_algorithm(state_space: StateSpace, algorithm: str, weight, heuristic: Optional[Heuristic] = None):
+    if algorithm == "dijkstra":
+        return _dijkstra
+    elif algorithm == "bidirectional_dijkstra":
+        return _bidirectional_dijkstra
+
+    if heuristic is None:
+        # the default heuristic counts transitions and is only admissible for unit costs, otherwise A* degrades to
+        # Dijkstra with the zero heuristic rather than returning paths that may not be shortest
+        heuristic = MoleculeBalanceHeuristic.from_grammar(state_space.grammar) if is_unit_cost(weight) else Heuristic()
+
+    if algorithm == "astar":
+        return functools.partial(_astar, heuristic=heuristic)
+    elif algorithm == "bidirectional_astar":
+        return functools.partial(_bidirectional_astar, heuristic=heuristic)
+
+    assert(False and "given algorithm not implemented")
+
+
 def shortest_path(state_space: StateSpace, weight=equal_weights,
-                  algorithm="dijkstra", verbosity: int = 0):
+                  algorithm="dijkstra", heuristic: Optional[Heuristic] = None, verbosity: int = 0):
+    """
+    :param algorithm: one of "dijkstra", "bidirectional_dijkstra", "astar" and "bidirectional_astar".
+    :param heuristic: the heuristic used by the A* variants, which must be admissible for `weight`.
+        Defaults to `MoleculeBalanceHeuristic.from_grammar` for unit cost weights, see `is_unit_cost`, and to the
+        zero heuristic otherwise.
+    """
     source = state_space.initial_node
     target = state_space.target_node
-    if algorithm == "dijkstra":
-        dist, path = _dijkstra(state_space, source, target, weight, verbosity=verbosity)
-    elif algorithm == "bidirectional_dijkstra":
-        dist, path = _bidirectional_dijkstra(state_space, source, target, weight, verbosity=verbosity)
+    path_algorithm = _path_algorithm(state_space, algorithm, weight, heuristic)
+    dist, path = path_algorithm(state_space, source, target, weight, verbosity=verbosity)
     return dist, state_space.get_path(path)
 
 
@@ -271,7 +649,7 @@ class PathBuffer:
 
 
 def shortest_simple_paths(state_space: StateSpace, weight=equal_weights,
-                          algorithm="dijkstra",
+                          algorithm="dijkstra", heuristic: Optional[Heuristic] = None,
                           expansion_limit: int = 0, verbosity: int = 0):
     source = state_space.initial_node
     target = state_space.target_node
@@ -280,13 +658,26 @@ def shortest_simple_paths(state_space: StateSpace, weight=equal_weights,
     listB = PathBuffer()
     prevPath = None
 
-    path_algorithm = None
-    if algorithm == "dijkstra":
-        path_algorithm = _dijkstra
-    elif algorithm == "bidirectional_dijkstra":
-        path_algorithm = _bidirectional_dijkstra
-    else:
-        assert(False and "given algorithm not implemented")
+    path_algorithm = _path_algorithm(state_space, algorithm, weight, heuristic)
+
+    # On a frozen state space the distances to the target never change, so for additive weights the reverse
+    # shortest path tree is computed once and reused by every spur search whose tree path avoids the removed nodes
+    # and edges. Other weights, e.g. the maximum energy along a path, are searched for every spur.
+    tree = _reverse_shortest_path_tree(state_space, target, weight) if \
+        state_space.is_frozen() and is_additive(weight) else None
+
+    def spur_search(spur, ignore_nodes=None, ignore_edges=None, spur_expansion_limit=0):
+        if tree is not None:
+            distance, next_edge = tree
+            if spur not in distance:
+                return None, None
+
+            dist, spur_path = _tree_path(spur, target, weight, 0, next_edge, ignore_nodes, ignore_edges)
+            if spur_path is not None:
+                return dist, spur_path
+
+        return path_algorithm(state_space, spur, target, weight, ignore_nodes, ignore_edges,
+                              expansion_limit=spur_expansion_limit, verbosity=verbosity)
 
     def lengthFunc(path):
         cost = 0
@@ -296,8 +687,7 @@ def shortest_simple_paths(state_space: StateSpace, weight=equal_weights,
 
     while True:
         if not prevPath:
-            dist, path = path_algorithm(state_space, source, target, weight, expansion_limit=expansion_limit,
-                                        verbosity=verbosity)
+            dist, path = spur_search(source, spur_expansion_limit=expansion_limit)
             if path is None:
                 return
             listB.push(dist, path)
@@ -310,8 +700,7 @@ def shortest_simple_paths(state_space: StateSpace, weight=equal_weights,
                     if path[:i] == root:
                         ignore_edges.add(state_space.get_edge(path[i - 1], path[i]))
 
-                dist, spur = path_algorithm(state_space, root[-1], target, weight, ignore_nodes, ignore_edges,
-                                            verbosity=verbosity)
+                dist, spur = spur_search(root[-1], ignore_nodes, ignore_edges)
                 ignore_nodes.add(root[-1])
 
                 if spur is None:
@@ -327,3 +716,143 @@ def shortest_simple_paths(state_space: StateSpace, weight=equal_weights,
             prevPath = path
         else:
             break
+
+
+def _reverse_shortest_path_tree(state_space: StateSpace, target: StateSpaceNode, weight):
+    """
+    Computes the distance of every node to `target` together with the first edge of a shortest path to it.
+    Edge costs are taken as `weight(0, edge)`, hence the weight must be additive (see `is_additive`).
+    """
+    distance: Dict[StateSpaceNode, float] = {target: 0}
+    next_edge: Dict[StateSpaceNode, Optional[StateSpaceEdge]] = {target: None}
+    done: Set[StateSpaceNode] = set()
+    fringe = make_priority_queue(weight)
+    fringe.push(target, 0)
+    while fringe:
+        dist, v = fringe.pop()
+        done.add(v)
+        for edge in state_space.expand_node(v, inverse=True):
+            if edge.source in done:
+                continue
+
+            alt = dist + weight(0, edge)
+            if edge.source not in distance or alt < distance[edge.source]:
+                distance[edge.source] = alt
+                next_edge[edge.source] = edge
+                fringe.push(edge.source, alt)
+
+    return distance, next_edge
+
+
+def _tree_path(spur: StateSpaceNode, target: StateSpaceNode, weight, start_cost: float,
+               next_edge: Dict[StateSpaceNode, Optional[StateSpaceEdge]], ignore_nodes, ignore_edges):
+    # The unrestricted shortest path in the tree is optimal whenever it avoids the ignored nodes and edges.
+    path: List[StateSpaceNode] = [spur]
+    cost = start_cost
+    while path[-1] != target:
+        edge = next_edge[path[-1]]
+        if (ignore_nodes and edge.target in ignore_nodes) or (ignore_edges and edge in ignore_edges):
+            return None, None
+        cost = weight(cost, edge)
+        path.append(edge.target)
+
+    return cost, path
+
+
+def _guided_spur(state_space: StateSpace, spur: StateSpaceNode, target: StateSpaceNode, weight, start_cost: float,
+                 distance: Dict[StateSpaceNode, float], next_edge: Dict[StateSpaceNode, Optional[StateSpaceEdge]],
+                 ignore_nodes: Set[StateSpaceNode], ignore_edges: Set[StateSpaceEdge]):
+    cost, path = _tree_path(spur, target, weight, start_cost, next_edge, ignore_nodes, ignore_edges)
+    if path is not None:
+        return cost, path
+
+    # Otherwise run A* using the tree distances, which are consistent lower bounds in the restricted space.
+    push = heapq.heappush
+    pop = heapq.heappop
+    dists = {spur: start_cost}
+    prev = {spur: None}
+    c = itertools.count()
+    fringe = [(start_cost + distance[spur], next(c), start_cost, spur)]
+    while fringe:
+        _, _, dist, v = pop(fringe)
+        if dist > dists[v]:
+            continue
+
+        if v == target:
+            return dist, _reconstruct_path(prev, v)
+
+        for edge in state_space.expand_node(v):
+            w = edge.target
+            if w in ignore_nodes or edge in ignore_edges or w not in distance:
+                continue
+
+            alt = weight(dist, edge)
+            if w not in dists or alt < dists[w]:
+                dists[w] = alt
+                prev[w] = v
+                push(fringe, (alt + distance[w], next(c), alt, w))
+
+    return None, None
+
+
+def k_shortest_simple_paths(state_space: StateSpace, weight=equal_weights):
+    """
+    Enumerates the simple paths from the initial to the target node of a frozen state space in order of
+    increasing weight, like `shortest_simple_paths`, but tuned for enumerating many paths:
+
+    * a single reverse shortest path tree to the target is computed up front. Spur paths are read directly off the
+      tree when it avoids the removed nodes and edges, and are otherwise found with A* guided by the tree distances;
+    * the edges to remove at a spur node are the children of the root path in a prefix trie of the accepted paths;
+    * following Lawler, spur paths are only computed from the node where a path deviates from its parent.
+
+    The tree only gives shortest paths for additive weights (see `is_additive`), other weights are enumerated by
+    `shortest_simple_paths` instead.
+    """
+    if not state_space.is_frozen():
+        raise ValueError("k_shortest_simple_paths requires a frozen state space")
+
+    if not is_additive(weight):
+        yield from shortest_simple_paths(state_space, weight)
+        return
+
+    source = state_space.initial_node
+    target = state_space.target_node
+    distance, next_edge = _reverse_shortest_path_tree(state_space, target, weight)
+    if source not in distance:
+        return
+
+    trie: Dict[StateSpaceNode, Dict] = {}
+    candidates = []
+    seen: Set[tuple] = set()
+    c = itertools.count()
+
+    cost, path = _guided_spur(state_space, source, target, weight, 0, distance, next_edge, set(), set())
+    heapq.heappush(candidates, (cost, next(c), tuple(path), 0))
+    seen.add(tuple(path))
+
+    while candidates:
+        _, _, path, deviation = heapq.heappop(candidates)
+        yield state_space.get_path(list(path))
+
+        trie_node = trie
+        for node in path:
+            trie_node = trie_node.setdefault(node, {})
+
+        trie_node = trie
+        root_nodes: Set[StateSpaceNode] = set()
+        root_cost = 0
+        for i in range(len(path) - 1):
+            spur = path[i]
+            trie_node = trie_node[spur]
+            if i >= deviation:
+                ignore_edges = {state_space.get_edge(spur, child) for child in trie_node}
+                spur_cost, spur_path = _guided_spur(state_space, spur, target, weight, root_cost, distance, next_edge,
+                                                    root_nodes, ignore_edges)
+                if spur_path is not None:
+                    candidate = path[:i] + tuple(spur_path)
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        heapq.heappush(candidates, (spur_cost, next(c), candidate, i))
+
+            root_nodes.add(spur)
+            root_cost = weight(root_cost, state_space.get_edge(spur, path[i + 1]))
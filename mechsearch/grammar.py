@@ -1,13 +1,16 @@
 from collections import Counter
 import json
 import os.path
-from mechsearch.atom_spectrum import AtomSpectrum
+from mechsearch.grammar_cache import GrammarCache, fingerprint
 from mechsearch.graph import Graph, GraphMultiset, Rule, Step
+from mechsearch.hydrogen_abstraction import abstract_graphs, abstract_rules
+from mechsearch.rule_canonicalisation import CanonSmilesRule
+from mechsearch.rule_index import RuleIndex
 from mechsearch.state import State, StateWithDistance
 import mod
 import networkx
 from numpy import load, ndarray
-from typing import Any, Dict, Iterator, List, Optional, Set, Union, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Union, Tuple
 
 
 def _rule_graph_to_networkx(rule_graph: Union[mod.Rule.LeftGraph, mod.Rule.RightGraph]) -> networkx.Graph:
@@ -44,16 +47,19 @@ def _get_rule_graphs(rule_graph: Union[mod.Rule.LeftGraph, mod.Rule.RightGraph])
 
 
 class Grammar:
-    def __init__(self, printer: mod.GraphPrinter = mod.GraphPrinter()):
+    def __init__(self, printer: mod.GraphPrinter = mod.GraphPrinter(),
+                 label_settings: Optional[mod.LabelSettings] = None):
         # mod.config.rule.printCombined = False
         mod.config.stereo.silenceDeductionWarnings = True
         self._printer = printer
 
-        self._label_settings: mod.LabelSettings = mod.LabelSettings(mod.LabelType.String, mod.LabelRelation.Isomorphism)
+        self._label_settings: mod.LabelSettings = label_settings if label_settings is not None else\
+            mod.LabelSettings(mod.LabelType.String, mod.LabelRelation.Isomorphism)
 
         self._graphs: List[Graph] = []
         self._rules: List[Rule] = []
         self._filtered_rules: Optional[List[Rule]] = None
+        self._rule_index: Optional[RuleIndex] = None
 
         self._initial_multiset: GraphMultiset = GraphMultiset()
         self._target_multiset: GraphMultiset = GraphMultiset()
@@ -67,6 +73,8 @@ class Grammar:
         result: Grammar = self.clone()
         list(result._get_graphs_by_isomorphism({graph.graph for graph in other._graphs}, True))
         result._rules.extend(other._rules)
+        if len(other._rules) > 0:
+            result._rule_index = None
         result._initial_multiset += GraphMultiset({result._get_graph_by_isomorphism(graph.graph, True): count for
                                                    graph, count in other.initial_multiset.counter.items()})
         result._target_multiset += GraphMultiset({result._get_graph_by_isomorphism(graph.graph, True): count for
@@ -101,11 +109,21 @@ class Grammar:
     @property
     def filtered_rules(self) -> List[Rule]:
         if self._filtered_rules is None:
-            self._filtered_rules = [rule for rule in self._rules if
-                                    self.initial_multiset.atom_spectrum >= rule.atom_spectrum > AtomSpectrum({})]
+            self._filtered_rules = self.rule_index.candidates(self.initial_multiset.atom_spectrum)
 
         return self._filtered_rules
 
+    @property
+    def rule_index(self) -> RuleIndex:
+        if self._rule_index is None:
+            self._rule_index = RuleIndex(self._rules)
+
+        return self._rule_index
+
+    @property
+    def rule_fingerprint(self) -> str:
+        return fingerprint(rule.rule.getGMLString() for rule in self._rules)
+
     @property
     def number_of_rules(self) -> int:
         return len(self._rules)
@@ -177,6 +195,7 @@ class Grammar:
 
     def _add_rule(self, rule: Rule) -> Rule:
         self._rules.append(rule)
+        self._rule_index = None
         return rule
 
     def _load_graphs(self, graph_objects: List[Dict[str, Any]], verbosity: int = 0):
@@ -203,9 +222,10 @@ class Grammar:
                          graph_json["rule"] == rule_name)) for functional_group_object in functional_group_objects}
 
     def clone(self) -> 'Grammar':
-        clone = Grammar(self.printer)
+        clone = Grammar(self.printer, self.label_settings)
         clone._graphs = self.graphs
         clone._rules = self.rules
+        clone._rule_index = self._rule_index
         clone._initial_multiset = GraphMultiset(self.initial_multiset.counter)
         clone._target_multiset = GraphMultiset(self.target_multiset.counter)
         clone._distance_matrix = self._distance_matrix
@@ -213,6 +233,49 @@ class Grammar:
 
         return clone
 
+    def abstract(self, cache: Optional[GrammarCache] = None):
+        """
+        Computes the hydrogen abstraction of every graph and rule of the grammar in one batch. If a cache is given,
+        abstractions computed by earlier runs are reused and new ones are persisted, the graph abstractions one entry
+        per graph and the rule abstractions under the rule fingerprint.
+        """
+        graph_cache = cache.entries("graph_abstraction") if cache is not None else {}
+        for graph, abstracted in zip(self._graphs, abstract_graphs((graph.graph for graph in self._graphs),
+                                                                   graph_cache)):
+            graph._abstracted = abstracted
+
+        key = self.rule_fingerprint
+        rule_cache: Dict[str, str] = cache.load(key, "rule_abstraction") if cache is not None else {}
+        number_of_entries = len(rule_cache)
+        for rule, abstracted in zip(self._rules, abstract_rules((rule.rule for rule in self._rules), rule_cache)):
+            rule._abstracted = abstracted
+
+        if cache is not None and len(rule_cache) > number_of_entries:
+            cache.store(key, "rule_abstraction", rule_cache)
+
+    def prewarm(self):
+        """
+        Computes the lazily derived rule data up front, i.e., atom spectra, canonical keys, inverse rules and the
+        applicability index. Grammars derived from this one share the results, and so do worker processes forked
+        after the call, which then only copy the pages they modify.
+        """
+        canonical_rules: Dict[CanonSmilesRule, Rule] = {}
+        for rule in self._rules:
+            inverse = rule.inverse_rule
+            for warmed_rule in (rule, inverse):
+                warmed_rule.atom_spectrum
+                # inserting computes the invariants, and the canonical SMILES keys wherever the invariants collide
+                canonical_rules.setdefault(warmed_rule.canonical_smiles, warmed_rule)
+
+        self.rule_index
+
+    def with_rules(self, rules: Iterable[Rule]) -> 'Grammar':
+        clone = self.clone()
+        clone._rules = list(rules)
+        clone._rule_index = None
+
+        return clone
+
     def load_file(self, filepath: str, verbosity: int = 0):
         with open(filepath, "r") as file:
             json_object = json.load(file)
@@ -331,6 +394,7 @@ class Grammar:
 
         if rule is not None:
             self._rules.remove(rule)
+            self._rule_index = None
 
         return rule
 
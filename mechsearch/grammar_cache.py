@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable
+
+
+default_cache_directory: str = ".mechsearch_cache"
+
+
+def fingerprint(strings: Iterable[str]) -> str:
+    """Order independent digest of a collection of strings, e.g. the GML strings of a rule set."""
+    digest = hashlib.sha256()
+    for string in sorted(strings):
+        digest.update(hashlib.sha256(string.encode()).digest())
+
+    return digest.hexdigest()
+
+
+class GrammarCache:
+    """
+    On-disk cache of compiled grammar data. Every entry is a JSON object stored under a key, typically the
+    fingerprint of a rule set or the digest of a single graph, and a section name such as "rule_abstraction".
+    """
+
+    def __init__(self, directory: str = default_cache_directory):
+        self._directory: str = os.path.join(directory, "grammar")
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _path(self, key: str, section: str) -> str:
+        return os.path.join(self._directory, f"{key}.{section}.json")
+
+    def load(self, key: str, section: str) -> Dict[str, Any]:
+        path = self._path(key, section)
+        if not os.path.exists(path):
+            return {}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def contains(self, key: str, section: str) -> bool:
+        return os.path.exists(self._path(key, section))
+
+    def entries(self, section: str) -> 'CacheSection':
+        return CacheSection(self, section)
+
+    def store(self, key: str, section: str, content: Dict[str, Any]):
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(key, section)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(content, f)
+
+        os.replace(temporary_path, path)
+
+
+class CacheSection:
+    """
+    Dictionary-like view of the string values stored under a section of a cache, one file per key. Concurrent
+    writers of different keys hence never overwrite each other, and entries do not grow with the number of keys.
+    """
+
+    def __init__(self, cache: GrammarCache, section: str):
+        self._cache: GrammarCache = cache
+        self._section: str = section
+        self._values: Dict[str, str] = {}
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self._values and self._cache.contains(key, self._section):
+            self._values[key] = self._cache.load(key, self._section)["value"]
+
+        return key in self._values
+
+    def __getitem__(self, key: str) -> str:
+        if key not in self:
+            raise KeyError(key)
+
+        return self._values[key]
+
+    def __setitem__(self, key: str, value: str):
+        self._cache.store(key, self._section, {"value": value})
+        self._values[key] = value
@@ -217,7 +217,7 @@ class Rule:
     @property
     def canonical_smiles(self) -> CanonSmilesRule:
         if self._canonical_smiles is None:
-            self._canonical_smiles = CanonSmilesRule(self.rule)
+            self._canonical_smiles = CanonSmilesRule.of(self.rule)
 
         return self._canonical_smiles
 
@@ -0,0 +1,80 @@
+from mechsearch.grammar import Grammar
+from mechsearch.graph import GraphMultiset
+from mechsearch.state import State
+from math import ceil
+from typing import Dict, Tuple
+
+
+class Heuristic:
+    """
+    Lower bound on the cost of reaching a goal multiset from a state. Subclasses must be admissible for the edge
+    weight they are used with; the heuristics below count transitions and are admissible for `equal_weights` and
+    `ConstantEdgeWeight` when `step_weight` is at most the weight of a single transition.
+    If `inverse` is set, the bound is for reaching the state from the goal, as needed by backward searches.
+    """
+
+    def __init__(self, step_weight: float = 1):
+        self._step_weight: float = step_weight
+        self._cache: Dict[Tuple[State, GraphMultiset, bool], float] = dict()
+
+    def __call__(self, state: State, goal: GraphMultiset, inverse: bool = False) -> float:
+        if (state, goal, inverse) not in self._cache:
+            self._cache[(state, goal, inverse)] = self._step_weight * self.compute_steps(state, goal, inverse)
+
+        return self._cache[(state, goal, inverse)]
+
+    def compute_steps(self, state: State, goal: GraphMultiset, inverse: bool = False) -> int:
+        return 0
+
+
+class MissingMoleculesHeuristic(Heuristic):
+    """
+    Counts the molecules of the goal that are not yet in the state. A single transition produces at most
+    `max_products` molecules, i.e., the number of right components of the largest rule.
+    """
+
+    def __init__(self, max_products: int = 1, max_sources: int = 1, step_weight: float = 1):
+        super().__init__(step_weight)
+        self._max_products: int = max(1, max_products)
+        self._max_sources: int = max(1, max_sources)
+
+    def compute_steps(self, state: State, goal: GraphMultiset, inverse: bool = False) -> int:
+        if inverse:
+            # going backwards the molecules of the state missing from the goal must be produced
+            missing = sum((state.graph_multiset.counter - goal.counter).values())
+        else:
+            missing = sum((goal.counter - state.graph_multiset.counter).values())
+
+        return ceil(missing / self._max_products)
+
+    @staticmethod
+    def from_grammar(grammar: Grammar, step_weight: float = 1) -> 'MissingMoleculesHeuristic':
+        return MissingMoleculesHeuristic(*_component_bounds(grammar), step_weight=step_weight)
+
+
+class MoleculeBalanceHeuristic(MissingMoleculesHeuristic):
+    """
+    Extends `MissingMoleculesHeuristic` by also counting the molecules of the state that are not in the goal. Each of
+    them must be consumed, and a single transition consumes at most `max_sources` molecules, i.e., the number of left
+    components of the largest rule.
+    """
+
+    def compute_steps(self, state: State, goal: GraphMultiset, inverse: bool = False) -> int:
+        state_counter, goal_counter = state.graph_multiset.counter, goal.counter
+        excess = sum((state_counter - goal_counter).values())
+        missing = sum((goal_counter - state_counter).values())
+        if inverse:
+            excess, missing = missing, excess
+
+        return max(ceil(excess / self._max_sources), ceil(missing / self._max_products))
+
+    @staticmethod
+    def from_grammar(grammar: Grammar, step_weight: float = 1) -> 'MoleculeBalanceHeuristic':
+        return MoleculeBalanceHeuristic(*_component_bounds(grammar), step_weight=step_weight)
+
+
+def _component_bounds(grammar: Grammar) -> Tuple[int, int]:
+    # rules are applied in both directions, so both sides bound both the products and the sources
+    largest_side = max((max(rule.rule.numLeftComponents, rule.rule.numRightComponents) for
+                        rule in grammar.rules), default=1)
+    return largest_side, largest_side
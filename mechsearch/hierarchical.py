@@ -0,0 +1,142 @@
+from mechsearch.enzyme_planner import prune_state_space
+from mechsearch.explore import bidirectional_bfs
+from mechsearch.grammar import Grammar
+from mechsearch.grammar_cache import GrammarCache
+from mechsearch.graph import Graph, GraphMultiset, Rule
+from mechsearch.state import State
+from mechsearch.state_space import StateSpace
+import mod
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+
+def _is_identity(rule: mod.Rule) -> bool:
+    """Whether applying the rule leaves the graphs unchanged, e.g. a proton shuffle after hydrogen abstraction."""
+    return all(not vertex.left.isNull() and not vertex.right.isNull() and
+               vertex.left.stringLabel == vertex.right.stringLabel for vertex in rule.vertices) and \
+        all(not edge.left.isNull() and not edge.right.isNull() and
+            edge.left.stringLabel == edge.right.stringLabel for edge in rule.edges)
+
+
+class HierarchicalSearch:
+    """
+    Two-level exploration over hydrogen abstracted grammars. The state space is first constructed on the abstracted
+    molecules and rules, where explicit hydrogens are collapsed into `HydAbs(label, count)` vertices. Only the rules
+    used by the abstract state space that connects the initial and target state, and the rules that are the identity
+    on abstracted molecules, are then used to construct the concrete state space, and concrete states are only kept
+    if their abstraction is a relevant abstract state.
+    """
+
+    def __init__(self, grammar: Grammar, cache: Optional[GrammarCache] = None):
+        grammar.abstract(cache)
+        self._grammar: Grammar = grammar
+        self._abstract_grammar: Grammar = Grammar(grammar.printer,
+                                                  mod.LabelSettings(mod.LabelType.Term,
+                                                                    mod.LabelRelation.Specialisation))
+        self._abstract_rules: Dict[mod.Rule, Rule] = {}
+
+        for rule in grammar.rules:
+            abstract_rule = self._abstract_grammar._add_rule(Rule(rule.abstract_rule, rule.steps))
+            self._abstract_rules[abstract_rule.rule] = rule
+
+        self._abstract_grammar._initial_multiset = self._abstract_multiset(grammar.initial_multiset, True)
+        self._abstract_grammar._target_multiset = self._abstract_multiset(grammar.target_multiset, True)
+
+        self._abstract_space: Optional[StateSpace] = None
+        self._relevant_states: Set[State] = set()
+        self._relevant_graphs: List[Graph] = []
+        self._abstract_graphs: Dict[int, mod.Graph] = {}
+        self._relevant_graph_cache: Dict[int, Optional[Graph]] = {}
+
+    @property
+    def abstract_grammar(self) -> Grammar:
+        return self._abstract_grammar
+
+    @property
+    def abstract_state_space(self) -> Optional[StateSpace]:
+        return self._abstract_space
+
+    def _abstract_multiset(self, graph_multiset: GraphMultiset, add: bool = False) -> Optional[GraphMultiset]:
+        counter: Counter = Counter()
+        for graph, count in graph_multiset.counter.items():
+            abstract_graph: mod.Graph = self._abstract_graph(graph)
+            if abstract_graph.numVertices == 0:
+                # e.g. protons vanish completely when hydrogens are abstracted
+                continue
+
+            if add:
+                abstract = self._abstract_grammar._get_graph_by_isomorphism(abstract_graph, True)
+            else:
+                abstract = self._find_relevant_graph(graph)
+
+            if abstract is None:
+                return None
+
+            counter[abstract] += count
+
+        return GraphMultiset(dict(counter))
+
+    def _abstract_graph(self, graph: Graph) -> mod.Graph:
+        # states create fresh graph wrappers when fired, hence abstractions are cached by graph id
+        if graph.id not in self._abstract_graphs:
+            self._abstract_graphs[graph.id] = graph.abstract_graph
+
+        return self._abstract_graphs[graph.id]
+
+    def _find_relevant_graph(self, graph: Graph) -> Optional[Graph]:
+        if graph.id not in self._relevant_graph_cache:
+            label_settings = mod.LabelSettings(mod.LabelType.String, mod.LabelRelation.Isomorphism)
+            abstract_graph: mod.Graph = self._abstract_graph(graph)
+            self._relevant_graph_cache[graph.id] = next(
+                (relevant for relevant in self._relevant_graphs if
+                 relevant.graph.isomorphism(abstract_graph, 1, label_settings)), None)
+
+        return self._relevant_graph_cache[graph.id]
+
+    def is_relevant(self, state: State) -> bool:
+        abstract_multiset: Optional[GraphMultiset] = self._abstract_multiset(state.graph_multiset)
+        return abstract_multiset is not None and State(abstract_multiset) in self._relevant_states
+
+    def explore_abstract(self, max_length: int, verbose: bool = False) -> StateSpace:
+        state_space = StateSpace(self._abstract_grammar)
+        bidirectional_bfs(state_space, max_length, verbose=verbose)
+        self._abstract_space = prune_state_space(state_space)
+
+        self._relevant_states = {node.state for node in self._abstract_space.graph.nodes}
+        self._relevant_graphs = list({graph for state in self._relevant_states for
+                                      graph in state.graph_multiset.graphs})
+        self._relevant_graph_cache = {}
+
+        return self._abstract_space
+
+    def refined_grammar(self) -> Grammar:
+        """
+        The grammar restricted to the rules used by the abstract state space. Rules whose abstraction is the identity,
+        e.g. pure proton shuffles, never label an abstract edge, but are kept as the concrete search may need them.
+        """
+        assert self._abstract_space is not None, "the abstract state space has not been explored"
+        used_rules: Set[Rule] = {rule for abstract_rule, rule in self._abstract_rules.items() if
+                                 _is_identity(abstract_rule)}
+        for edge in self._abstract_space.edges():
+            for transition in edge.transitions:
+                used_rules.update(self._abstract_rules[rule] for rule in transition.rules if
+                                  rule in self._abstract_rules)
+
+        return self._grammar.with_rules(rule for rule in self._grammar.rules if rule in used_rules)
+
+    def explore(self, max_length: int, verbose: bool = False) -> StateSpace:
+        """
+        Constructs the abstract state space of depth `max_length` and refines the abstract paths reaching the target
+        into a concrete state space of the same depth.
+        :param max_length: the maximal length of the mechanisms.
+        :param verbose: print the progress of both searches.
+        :return: the concrete state space restricted to refinements of relevant abstract states.
+        """
+        self.explore_abstract(max_length, verbose)
+        if verbose:
+            print(f"Abstract relevant state space: {self._abstract_space}")
+
+        state_space = StateSpace(self.refined_grammar())
+        state_space.set_state_filter(self.is_relevant)
+        bidirectional_bfs(state_space, max_length, verbose=verbose)
+        return state_space
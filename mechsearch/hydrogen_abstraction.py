@@ -1,12 +1,38 @@
+from mechsearch.grammar_cache import CacheSection
+import hashlib
 import mod
 import re
-from typing import Dict, List, Optional, Set
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Union
 
 
-hydrogen_pattern = re.compile("H")
+hydrogen_pattern = re.compile(r"^[\s]*H[0-9]*[+\-]*[\s]*$")
 element_pattern = re.compile("^[\s]*[a-zA-Z]+")
 
 
+@lru_cache(maxsize=None)
+def _is_hydrogen(label: str) -> bool:
+    return hydrogen_pattern.match(label) is not None
+
+
+@lru_cache(maxsize=None)
+def _element(label: str) -> str:
+    return element_pattern.match(label).group(0)
+
+
+@lru_cache(maxsize=None)
+def _local_charge(label: str) -> int:
+    if label.endswith("+"):
+        return 1
+    elif label.endswith("-"):
+        return -1
+    return 0
+
+
+def _edge_gml(edge) -> str:
+    return f"edge [ source {edge.source.id} target {edge.target.id} label \"{edge.stringLabel}\" ]"
+
+
 expected_bond_counts: Dict[str, int] = {"C": 4, "O": 2, "N": 3, "S": 2, "P": 5}
 
 
@@ -20,7 +46,7 @@ class Vertex:
         return f"node [ id {self._original.id} label \"{label}\" ]"
 
     def add_hydrogen(self):
-        self._hydrogen_count += 0
+        self._hydrogen_count += 1
 
 
 class RuleVertex:
@@ -32,12 +58,8 @@ class RuleVertex:
         self._right_bound_electrons: float = 0
 
     def _label_vertex(self, label: str, hydrogen_count: int, bound_electrons: float) -> str:
-        element = element_pattern.match(label).group(0)
-        local_charge = 0
-        if label.endswith("+"):
-            local_charge = 1
-        elif label.endswith("-"):
-            local_charge = -1
+        element = _element(label)
+        local_charge = _local_charge(label)
 
         hydrogen_string = str(hydrogen_count)
         if element not in expected_bond_counts or bound_electrons < (expected_bond_counts[element] + local_charge):
@@ -109,7 +131,7 @@ class RuleVertex:
             self._right_bound_electrons += 1.5
 
 
-def abstract_graph(graph: mod.Graph) -> mod.Graph:
+def abstract_graph_gml(graph: mod.Graph) -> str:
     new_nodes: Dict[mod.Graph.Vertex, Vertex] = {}
     preserved_edges: List[mod.Graph.Edge] = list()
 
@@ -117,10 +139,10 @@ def abstract_graph(graph: mod.Graph) -> mod.Graph:
         preserved_nodes: Set[mod.Graph.Vertex] = set()
         hydrogenated_node: Optional[mod.Graph.Vertex] = None
 
-        if hydrogen_pattern.match(edge.source.stringLabel):
+        if _is_hydrogen(edge.source.stringLabel):
             preserved_nodes.add(edge.target)
             hydrogenated_node = edge.target
-        elif hydrogen_pattern.match(edge.target.stringLabel):
+        elif _is_hydrogen(edge.target.stringLabel):
             preserved_nodes.add(edge.source)
             hydrogenated_node = edge.source
         else:
@@ -134,13 +156,22 @@ def abstract_graph(graph: mod.Graph) -> mod.Graph:
         if hydrogenated_node is not None:
             new_nodes[hydrogenated_node].add_hydrogen()
 
-    gml: str = f"graph [ " + " ".join(str(vertex) for vertex in new_nodes.values()) + " " +\
-               " ".join(f"edge [ source {edge.source.id} target {edge.target.id} label \"{edge.stringLabel}\" ]" for
-                        edge in preserved_edges) + " ]"
-    return mod.graphGMLString(gml, add=False)
+    for vertex in graph.vertices:
+        if vertex.degree == 0 and not _is_hydrogen(vertex.stringLabel):
+            new_nodes[vertex] = Vertex(vertex)
 
+    segments: List[str] = ["graph ["]
+    segments.extend(str(vertex) for vertex in new_nodes.values())
+    segments.extend(_edge_gml(edge) for edge in preserved_edges)
+    segments.append("]")
+    return " ".join(segments)
 
-def abstract_rule(rule: mod.Rule) -> mod.Rule:
+
+def abstract_graph(graph: mod.Graph) -> mod.Graph:
+    return mod.graphGMLString(abstract_graph_gml(graph), add=False)
+
+
+def abstract_rule_gml(rule: mod.Rule) -> str:
     new_nodes: Dict[mod.Rule.Vertex, RuleVertex] = dict()
     preserved_edges: List[mod.Rule.Edge] = list()
 
@@ -148,10 +179,10 @@ def abstract_rule(rule: mod.Rule) -> mod.Rule:
         preserved_nodes: Set[mod.Rule.Vertex] = set()
         hydrogen_node: Optional[mod.Rule.Vertex] = None
 
-        if hydrogen_pattern.match(edge.source.left.stringLabel):
+        if _is_hydrogen(edge.source.left.stringLabel):
             preserved_nodes.add(edge.target)
             hydrogen_node = edge.source
-        elif hydrogen_pattern.match(edge.target.left.stringLabel):
+        elif _is_hydrogen(edge.target.left.stringLabel):
             preserved_nodes.add(edge.source)
             hydrogen_node = edge.target
         else:
@@ -182,16 +213,53 @@ def abstract_rule(rule: mod.Rule) -> mod.Rule:
     right_edges = list(edge.right for edge in preserved_edges if edge.right and
                        (not edge.left or edge.left.bondType != edge.right.bondType))
 
-    left_gml: str = f"left [ " + " ".join(vertex.left_string() for vertex in new_nodes.values()) + " " +\
-                    " ".join(f"edge [ source {edge.source.id} target {edge.target.id} label \"{edge.stringLabel}\" ]"
-                             for edge in left_edges) + " ]"
-    context_gml: str = f"context [ " + " ".join(vertex.context_string() for vertex in new_nodes.values()) + " " +\
-                       " ".join(f"edge [ source {edge.source.id} target {edge.target.id} label \"{edge.stringLabel}\" ]"
-                                for edge in context_edges) + " ]"
-    right_gml: str = f"right [ " + " ".join(vertex.right_string() for vertex in new_nodes.values()) + " " +\
-                     " ".join(f"edge [ source {edge.source.id} target {edge.target.id} label \"{edge.stringLabel}\" ]"
-                              for edge in right_edges) + " ]"
+    segments: List[str] = ["rule [", "left ["]
+    segments.extend(vertex.left_string() for vertex in new_nodes.values())
+    segments.extend(_edge_gml(edge) for edge in left_edges)
+    segments.extend(["]", "context ["])
+    segments.extend(vertex.context_string() for vertex in new_nodes.values())
+    segments.extend(_edge_gml(edge) for edge in context_edges)
+    segments.extend(["]", "right ["])
+    segments.extend(vertex.right_string() for vertex in new_nodes.values())
+    segments.extend(_edge_gml(edge) for edge in right_edges)
+    segments.extend(["]", "]"])
+    return " ".join(segment for segment in segments if segment)
 
-    gml: str = "rule [ " + " ".join([left_gml, context_gml, right_gml]) + " ]"
-    return mod.ruleGMLString(gml, add=False)
 
+def abstract_rule(rule: mod.Rule) -> mod.Rule:
+    return mod.ruleGMLString(abstract_rule_gml(rule), add=False)
+
+
+def _source_key(gml: str) -> str:
+    return hashlib.blake2b(gml.encode(), digest_size=16).hexdigest()
+
+
+def abstract_graphs(graphs: Iterable[mod.Graph],
+                    cache: Optional[Union[Dict[str, str], CacheSection]] = None) -> List[mod.Graph]:
+    """
+    Abstracts a batch of graphs. The abstracted GML of every graph is looked up in, and added to, the given cache,
+    e.g. a section of a `GrammarCache`, which maps a digest of the GML of the original graph to the GML of its
+    abstraction.
+    """
+    cache = cache if cache is not None else {}
+    abstracted: List[mod.Graph] = []
+    for graph in graphs:
+        key = _source_key(graph.getGMLString())
+        if key not in cache:
+            cache[key] = abstract_graph_gml(graph)
+        abstracted.append(mod.graphGMLString(cache[key], add=False))
+
+    return abstracted
+
+
+def abstract_rules(rules: Iterable[mod.Rule], cache: Optional[Dict[str, str]] = None) -> List[mod.Rule]:
+    """Abstracts a batch of rules, see `abstract_graphs`."""
+    cache = cache if cache is not None else {}
+    abstracted: List[mod.Rule] = []
+    for rule in rules:
+        key = _source_key(rule.getGMLString())
+        if key not in cache:
+            cache[key] = abstract_rule_gml(rule)
+        abstracted.append(mod.ruleGMLString(cache[key], add=False))
+
+    return abstracted
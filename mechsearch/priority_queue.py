@@ -0,0 +1,175 @@
+from collections import deque
+import itertools
+from typing import Any, Deque, Dict, Hashable, List, Tuple
+
+
+class PriorityQueue:
+    """
+    Min-priority queue over hashable items. Pushing an item that is already queued with a higher priority decreases
+    its key, pushing it with a lower or equal priority is a no-op. Items of equal priority are popped in insertion
+    order.
+    """
+
+    def push(self, item: Hashable, priority: Any):
+        """Inserts the item, or decreases its priority if it is queued with a higher one."""
+        pass
+
+    def pop(self) -> Tuple[Any, Hashable]:
+        """Removes and returns the priority and the item with the smallest priority."""
+        pass
+
+    def priority(self, item: Hashable) -> Any:
+        """The priority of a queued item."""
+        pass
+
+    def __contains__(self, item: Hashable) -> bool:
+        pass
+
+    def __len__(self) -> int:
+        pass
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+
+class BucketQueue(PriorityQueue):
+    """
+    Bucket queue for non-negative integer priorities. Every priority has a FIFO bucket and the cursor points at the
+    smallest possibly non-empty bucket. A decrease-key appends the item to its new bucket and leaves a stale entry in
+    the old one, which is skipped when reached. Pushes and pops are O(1) amortised plus the number of empty buckets the
+    cursor passes, which is bounded by the largest priority for Dijkstra-like (monotone) usage.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[int, Deque[Hashable]] = {}
+        self._priorities: Dict[Hashable, int] = {}
+        self._cursor: int = 0
+
+    def push(self, item: Hashable, priority: int):
+        if priority < 0 or priority != int(priority):
+            raise ValueError(f"BucketQueue requires non-negative integer priorities, got {priority}")
+
+        priority = int(priority)
+        if item in self._priorities and self._priorities[item] <= priority:
+            return
+
+        self._priorities[item] = priority
+        if priority not in self._buckets:
+            self._buckets[priority] = deque()
+        self._buckets[priority].append(item)
+        self._cursor = min(self._cursor, priority)
+
+    def pop(self) -> Tuple[int, Hashable]:
+        if not self._priorities:
+            raise IndexError("pop from an empty priority queue")
+
+        while True:
+            bucket = self._buckets.get(self._cursor)
+            while bucket:
+                item = bucket.popleft()
+                if self._priorities.get(item) == self._cursor:
+                    del self._priorities[item]
+                    if not bucket:
+                        del self._buckets[self._cursor]
+                    return self._cursor, item
+
+            self._buckets.pop(self._cursor, None)
+            self._cursor += 1
+
+    def priority(self, item: Hashable) -> int:
+        return self._priorities[item]
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._priorities
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+
+class IndexedHeap(PriorityQueue):
+    """
+    Binary heap with a position index over its items, supporting decrease-key in O(log n) without stale entries.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[Any, int, Hashable]] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._counter = itertools.count()
+
+    def push(self, item: Hashable, priority: Any):
+        if item in self._positions:
+            position = self._positions[item]
+            if self._heap[position][0] <= priority:
+                return
+
+            self._heap[position] = (priority, self._heap[position][1], item)
+            self._sift_up(position)
+            return
+
+        self._heap.append((priority, next(self._counter), item))
+        self._positions[item] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def pop(self) -> Tuple[Any, Hashable]:
+        if not self._heap:
+            raise IndexError("pop from an empty priority queue")
+
+        priority, _, item = self._heap[0]
+        last = self._heap.pop()
+        del self._positions[item]
+        if self._heap:
+            self._heap[0] = last
+            self._positions[last[2]] = 0
+            self._sift_down(0)
+
+        return priority, item
+
+    def priority(self, item: Hashable) -> Any:
+        return self._heap[self._positions[item]][0]
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._positions
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _swap(self, i: int, j: int):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._positions[heap[i][2]] = i
+        self._positions[heap[j][2]] = j
+
+    def _sift_up(self, position: int):
+        heap = self._heap
+        while position > 0:
+            parent = (position - 1) >> 1
+            if heap[position][:2] >= heap[parent][:2]:
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position: int):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and heap[child][:2] < heap[smallest][:2]:
+                    smallest = child
+            if smallest == position:
+                break
+            self._swap(position, smallest)
+            position = smallest
+
+
+def is_integral(weight) -> bool:
+    """Whether the weight function declares that it maps integer weights to integer weights."""
+    return bool(getattr(weight, "integral", False))
+
+
+def make_priority_queue(weight) -> PriorityQueue:
+    """Returns a bucket queue for integral weight functions and an indexed heap otherwise."""
+    if is_integral(weight):
+        return BucketQueue()
+
+    return IndexedHeap()
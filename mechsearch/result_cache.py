@@ -0,0 +1,105 @@
+from mechsearch.grammar import Grammar
+from mechsearch.grammar_cache import default_cache_directory
+from mechsearch.state_space import StateSpace
+import mod
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def canonical_graph_string(graph: mod.Graph) -> str:
+    try:
+        return graph.smiles
+    except Exception:
+        # graphs without a SMILES string are identified by their DFS string, which may only cause cache misses
+        return graph.graphDFS
+
+
+def canonical_multiset(graphs: Iterable[mod.Graph]) -> List[str]:
+    return sorted(canonical_graph_string(graph) for graph in graphs)
+
+
+def state_space_key(reactants: Iterable[mod.Graph], products: Iterable[mod.Graph], aminos: Iterable[mod.Graph],
+                    rule_fingerprint: str, max_depth: int, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Content address of a computed state space, combining the canonical reactant and product multisets, the amino
+    acid set, the fingerprint of the rule set, the search depth and any further options of the computation.
+    """
+    content = {"reactants": canonical_multiset(reactants),
+               "products": canonical_multiset(products),
+               "aminos": sorted(set(canonical_multiset(aminos))),
+               "rules": rule_fingerprint,
+               "max_depth": max_depth,
+               "options": options if options is not None else {}}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class StateSpaceCache:
+    """
+    On-disk cache of finished state spaces keyed by `state_space_key`. The state spaces are stored as JSON and refer
+    to the dump of their derivation graph by its content hash, so identical dumps are only stored once.
+    """
+
+    def __init__(self, directory: str = default_cache_directory):
+        self._directory: str = os.path.join(directory, "state_spaces")
+        self._dg_directory: str = os.path.join(self._directory, "dg")
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def _dg_path(self, dg_hash: str) -> str:
+        return os.path.join(self._dg_directory, f"{dg_hash}.dg")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def load(self, key: str, grammar: Grammar) -> Optional[StateSpace]:
+        """Returns the cached state space, whose molecules and rules are resolved against `grammar`."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            entry = json.load(f)
+
+        dg_path = self._dg_path(entry["dg"])
+        if not os.path.exists(dg_path):
+            return None
+
+        return StateSpace.from_json(entry["state_space"], grammar, dg_path)
+
+    def store(self, key: str, state_space: StateSpace):
+        os.makedirs(self._dg_directory, exist_ok=True)
+
+        # a file of its own, MOD's default dump names come from a counter that forked workers inherit
+        fd, dump_path = tempfile.mkstemp(suffix=".dg.tmp", dir=self._dg_directory)
+        os.close(fd)
+        dump_path = state_space.derivation_graph.dump(dump_path)
+        dg_hash = _file_digest(dump_path)
+        dg_path = self._dg_path(dg_hash)
+        if os.path.exists(dg_path):
+            os.remove(dump_path)
+        else:
+            os.replace(dump_path, dg_path)
+
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"dg": dg_hash, "state_space": state_space.to_json()}, f)
+
+        os.replace(temporary_path, path)
@@ -1,10 +1,42 @@
 import networkx as nx
 import mod
-from typing import List
+import hashlib
+from typing import Dict, List, Optional, Tuple
 
 
 _label_to_isotope_map = {}
 
+# Canonical keys are memoised per rule id.
+_canonical_rules: Dict[int, 'CanonSmilesRule'] = {}
+
+
+def _side_label(item) -> str:
+    left_label = item.left.stringLabel if not item.left.isNull() else ''
+    right_label = item.right.stringLabel if not item.right.isNull() else ''
+    return f'({left_label},  {right_label}'
+
+
+def _digest(label: str) -> str:
+    return hashlib.blake2b(label.encode(), digest_size=16).hexdigest()
+
+
+def _weisfeiler_lehman_hash(rule: mod.Rule, iterations: int = 3) -> str:
+    labels: Dict[int, str] = {v.id: _digest(_side_label(v)) for v in rule.vertices}
+    neighbours: Dict[int, List[Tuple[str, int]]] = {vertex_id: [] for vertex_id in labels}
+    for e in rule.edges:
+        edge_label = _side_label(e)
+        neighbours[e.source.id].append((edge_label, e.target.id))
+        neighbours[e.target.id].append((edge_label, e.source.id))
+
+    histogram: List[str] = sorted(labels.values())
+    for _ in range(iterations):
+        labels = {vertex_id: _digest(label + '|' + ','.join(sorted(f'{edge_label}:{labels[other]}' for
+                                                                     edge_label, other in neighbours[vertex_id])))
+                  for vertex_id, label in labels.items()}
+        histogram.extend(sorted(labels.values()))
+
+    return _digest(' '.join(histogram))
+
 
 def _rule_graph_to_nx(rule_graph):
     g = nx.Graph()
@@ -120,14 +152,15 @@ def _get_graphs(rule_graph):
 
 
 class CanonSmilesRule:
+    """
+    Canonical key of a rule up to isomorphism. A Weisfeiler-Lehman hash of the rule's core graph serves as the
+    first-level key; the canonical SMILES key is only computed when two rules share the same hash.
+    """
+
     def __init__(self, rule: mod.Rule):
         self._rule = rule
-        graphs: List[mod.Graph] = _get_graphs(rule)
-
-        smiles_strings = [g.smiles for g in graphs]
-        smiles_strings.sort()
-
-        self._key = tuple(smiles_strings)
+        self._invariant: str = _weisfeiler_lehman_hash(rule)
+        self._key: Optional[Tuple[str, ...]] = None
     #     self._left = CanonSmilesSideGraph(rule.left)
     #     self._right = CanonSmilesSideGraph(rule.right)
     #
@@ -139,15 +172,37 @@ class CanonSmilesRule:
     # def right(self):
     #     return self._right
 
+    @staticmethod
+    def of(rule: mod.Rule) -> 'CanonSmilesRule':
+        if rule.id not in _canonical_rules:
+            _canonical_rules[rule.id] = CanonSmilesRule(rule)
+
+        return _canonical_rules[rule.id]
+
+    @property
+    def invariant(self) -> str:
+        return self._invariant
+
     @property
     def key(self):
+        if self._key is None:
+            graphs: List[mod.Graph] = _get_graphs(self._rule)
+
+            smiles_strings = [g.smiles for g in graphs]
+            smiles_strings.sort()
+
+            self._key = tuple(smiles_strings)
+
         return self._key
 
     def __hash__(self):
-        return hash(self.key)
+        return hash(self.invariant)
 
     def __eq__(self, other: 'CanonSmilesRule') -> bool:
-        return self.key == other.key
+        if self is other:
+            return True
+
+        return self.invariant == other.invariant and self.key == other.key
 
     def __ne__(self, other: 'CanonSmilesRule') -> bool:
         return not self == other
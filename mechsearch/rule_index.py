@@ -0,0 +1,70 @@
+from mechsearch.atom_spectrum import AtomSpectrum
+from mechsearch.graph import Rule
+from bisect import bisect_right
+import numpy as np
+from typing import Iterable, List, Sequence
+
+
+def _to_bitset(indices: Iterable[int]) -> int:
+    bits = 0
+    for index in indices:
+        bits |= 1 << int(index)
+    return bits
+
+
+def _from_bitset(bits: int) -> List[int]:
+    indices: List[int] = []
+    while bits:
+        lowest = bits & -bits
+        indices.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return indices
+
+
+class RuleIndex:
+    """
+    Index over the atom spectra of a rule set used to find the rules that are applicable to a multiset spectrum.
+    For every element the distinct requirement thresholds of the rules are kept sorted together with the set of rules
+    (as a bitset) requiring at least that many atoms of the element. A query excludes, per element, every rule
+    requiring more atoms than the multiset provides including its free wildcards, and only runs the exact wildcard
+    balance check on the remaining candidates.
+    """
+
+    def __init__(self, rules: Sequence[Rule]):
+        self._rules: List[Rule] = list(rules)
+        self._counts, self._wildcards = AtomSpectrum.stack([rule.atom_spectrum for rule in self._rules])
+
+        self._non_empty: int = _to_bitset(np.flatnonzero(~AtomSpectrum.is_empty(self._counts, self._wildcards)))
+
+        self._thresholds: List[List[int]] = []
+        self._requiring: List[List[int]] = []
+        for column in self._counts.T:
+            thresholds = sorted(set(int(count) for count in column if count > 0))
+            self._thresholds.append(thresholds)
+            self._requiring.append([_to_bitset(np.flatnonzero(column >= threshold)) for threshold in thresholds])
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    @property
+    def rules(self) -> List[Rule]:
+        return list(self._rules)
+
+    def _candidate_bits(self, spectrum: AtomSpectrum) -> int:
+        available = spectrum.counts(len(self._thresholds)) + spectrum.wildcard_atom_count
+        excluded = 0
+        for element, thresholds in enumerate(self._thresholds):
+            position = bisect_right(thresholds, int(available[element]))
+            if position < len(thresholds):
+                excluded |= self._requiring[element][position]
+
+        return self._non_empty & ~excluded
+
+    def candidates(self, spectrum: AtomSpectrum) -> List[Rule]:
+        """Returns the rules `rule` satisfying `spectrum >= rule.atom_spectrum > AtomSpectrum({})` in rule order."""
+        indices = np.asarray(_from_bitset(self._candidate_bits(spectrum)), dtype=np.int64)
+        if len(indices) == 0:
+            return []
+
+        mask = spectrum.covers(self._counts[indices], self._wildcards[indices])
+        return [self._rules[index] for index in indices[mask]]
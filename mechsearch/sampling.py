@@ -0,0 +1,125 @@
+from mechsearch.state_space import StateSpace, StateSpaceEdge, Path
+from bisect import bisect_right
+import itertools
+import random
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+
+Count = Union[int, float]
+
+
+def _is_simple(path: Path) -> bool:
+    if len(path) == 0:
+        return True
+
+    nodes = [edge.source for edge in path] + [path[-1].target]
+    return len(set(nodes)) == len(nodes)
+
+
+class MechanismSampler:
+    """
+    Draws mechanisms from a frozen state space uniformly at random among all paths of length at most `max_length`
+    from the initial to the target node, or, if an edge factor function is given, with probability proportional to
+    the product of the factors of the edges on the path. Paths end at the first visit of the target node but may
+    revisit other states. Constrained state spaces are sampled in the same way, yielding only qualifying mechanisms.
+
+    The number of paths from every node to the target with each remaining length is computed once, after which
+    every sample is drawn in time linear in its length.
+    """
+
+    def __init__(self, state_space: StateSpace, max_length: int,
+                 edge_factor: Optional[Callable[[StateSpaceEdge], float]] = None, seed: Optional[int] = None):
+        if not state_space.is_frozen():
+            raise ValueError("MechanismSampler requires a frozen state space")
+
+        self._state_space: StateSpace = state_space
+        self._index = state_space.index
+        self._random: random.Random = random.Random(seed)
+        self._factors: Optional[List[float]] = None
+        if edge_factor is not None:
+            self._factors = [edge_factor(edge) for edge in self._index.out_edges]
+
+        zero: Count = 0 if self._factors is None else 0.0
+        counts: List[List[Count]] = [[zero] * self._index.number_of_nodes]
+        counts[0][self._index.target] = 1
+        for _ in range(max_length):
+            previous = counts[-1]
+            current: List[Count] = [zero] * self._index.number_of_nodes
+            for v in range(self._index.number_of_nodes):
+                if v == self._index.target:
+                    continue
+
+                total = zero
+                for position in range(self._index.out_offsets[v], self._index.out_offsets[v + 1]):
+                    total += self._factor(position) * previous[self._index.out_heads[position]]
+                current[v] = total
+            counts.append(current)
+
+        self._counts: List[List[Count]] = counts
+        self._length_cumulative: List[Count] = list(itertools.accumulate(
+            counts[length][self._index.source] for length in range(max_length + 1)))
+        self._successor_cumulative: Dict[Tuple[int, int], List[Count]] = {}
+
+    def _factor(self, position: int) -> Count:
+        return 1 if self._factors is None else self._factors[position]
+
+    def _draw(self, cumulative: List[Count]) -> int:
+        if self._factors is None:
+            value = self._random.randrange(cumulative[-1])
+        else:
+            value = self._random.random() * cumulative[-1]
+        return min(bisect_right(cumulative, value), len(cumulative) - 1)
+
+    def _successors(self, v: int, remaining: int) -> List[Count]:
+        if (v, remaining) not in self._successor_cumulative:
+            start, end = self._index.out_offsets[v], self._index.out_offsets[v + 1]
+            self._successor_cumulative[(v, remaining)] = list(itertools.accumulate(
+                self._factor(position) * self._counts[remaining - 1][self._index.out_heads[position]] for
+                position in range(start, end)))
+
+        return self._successor_cumulative[(v, remaining)]
+
+    @property
+    def number_of_paths(self) -> Count:
+        """The number of paths (or their total weight) that are sampled from."""
+        return self._length_cumulative[-1]
+
+    def sample(self) -> Path:
+        if not self.number_of_paths:
+            raise ValueError("the state space contains no path within the length bound")
+
+        remaining = self._draw(self._length_cumulative)
+        v = self._index.source
+        nodes: List[int] = [v]
+        while remaining > 0:
+            position = self._index.out_offsets[v] + self._draw(self._successors(v, remaining))
+            v = self._index.out_heads[position]
+            nodes.append(v)
+            remaining -= 1
+
+        # the state space maps the nodes to a path, e.g., a constrained state space maps them to the underlying one
+        return self._state_space.get_path([self._index.nodes[node] for node in nodes])
+
+    def sample_simple(self, max_attempts: Optional[int] = None) -> Path:
+        """
+        Draws a mechanism that does not revisit a state by rejecting the samples that do. As every path is drawn
+        with the same probability (or proportionally to its weight), the result is uniform among the simple paths.
+        The expected number of attempts is the ratio of all to simple paths, which grows quickly with the length
+        bound when most transitions can be reversed.
+        :param max_attempts: if given, a ValueError is raised when no simple path is drawn in this many attempts.
+        """
+        for _ in (range(max_attempts) if max_attempts is not None else itertools.count()):
+            path = self.sample()
+            if _is_simple(path):
+                return path
+
+        raise ValueError(f"no simple mechanism was drawn in {max_attempts} attempts")
+
+    def stream(self, num_samples: Optional[int] = None, simple: bool = False,
+               max_attempts: Optional[int] = None) -> Iterator[Path]:
+        """
+        Yields `num_samples` independent samples, or samples indefinitely if no number is given. If `simple`, only
+        paths that do not revisit a state are yielded, see `sample_simple`.
+        """
+        for _ in (range(num_samples) if num_samples is not None else itertools.count()):
+            yield self.sample_simple(max_attempts) if simple else self.sample()
@@ -2,6 +2,7 @@ from mechsearch.dg_expander import DGExpander
 from mechsearch.grammar import Grammar
 from mechsearch.state import State
 from mechsearch.dot_printer import DotNode, DotGraph, DotEdge
+from mechsearch.state_space_index import StateSpaceIndex
 import mod
 from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import networkx as nx
@@ -246,12 +247,17 @@ class StateSpace:
         self._state2node: Dict[State, StateSpaceNode] = {}
         self._expanded_nodes: Set[StateSpaceNode] = set()
         self._inverse_expanded_nodes: Set[StateSpaceNode] = set()
+        self._next_node_id: int = 0
+        self._expansion_limit: Optional[int] = None
+        self._state_filter: Optional[Callable[[State], bool]] = None
+        self._index: Optional[StateSpaceIndex] = None
+        # incremented by every change of the graph, the index is rebuilt when it was built for an older version
+        self._version: int = 0
+        self._index_version: int = -1
         if grammar.number_of_graphs > 0:
             self._initial_node: StateSpaceNode = self._add_state(grammar.initial_state)
             self._target_node: StateSpaceNode = self._add_state(grammar.target_state)
 
-        self._expansion_limit: Optional[int] = None
-
     def sub_space(self, use_node: Set[StateSpaceNode],
                   update_dg: bool = False):
         state_space = StateSpace(self._grammar, self._dg_expander)
@@ -267,6 +273,7 @@ class StateSpace:
         state_space._inverse_expanded_nodes = {
             n for n in self._inverse_expanded_nodes if n in use_node
         }
+        state_space._next_node_id = self._next_node_id
 
         mod_edges = list(itertools.chain.from_iterable([list(self.get_edge(src, tar).transitions)
                                                         for src, tar in self._graph.edges]))
@@ -282,6 +289,7 @@ class StateSpace:
             oldEdge = state_space.get_edge(oldSrc, oldTar)
             newEdge = StateSpaceEdge(newSrc, newTar, oldEdge.transitions)
             self._graph.add_edge(newSrc, newTar, edge=newEdge)
+        self._version += 1
 
         rootEdge = StateSpaceEdge(self._initial_node, node2node[state_space._initial_node], [])
         self._graph.add_edge(self._initial_node, node2node[state_space._initial_node], edge=rootEdge)
@@ -327,6 +335,7 @@ class StateSpace:
         id2node: Dict[int, StateSpaceNode] = {
             n.id: n for n in state_space._graph.nodes
         }
+        state_space._next_node_id = max(id2node, default=-1) + 1
         id2hyper: Dict[int, mod.DGHyperEdge] = {
             e.id: e for e in dg.edges
         }
@@ -349,6 +358,10 @@ class StateSpace:
         for src, tar in self._graph.edges:
             yield self.get_edge(src, tar)
 
+    @property
+    def grammar(self) -> Grammar:
+        return self._grammar
+
     @property
     def initial_node(self) -> StateSpaceNode:
         return self._initial_node
@@ -392,7 +405,10 @@ class StateSpace:
         return self._expansion_limit > len(self.expanded_nodes)
 
     def _add_state(self, state: State) -> StateSpaceNode:
-        node = StateSpaceNode(len(self._graph), state)
+        # node ids are never reused, as nodes may be removed from the state space
+        node = StateSpaceNode(self._next_node_id, state)
+        self._next_node_id += 1
+        self._version += 1
         self._state2node[state] = node
         self._graph.add_node(node)
         return node
@@ -400,11 +416,57 @@ class StateSpace:
     def _add_edge(self, source: StateSpaceNode, target: StateSpaceNode, transition: mod.DGHyperEdge):
         edge = StateSpaceEdge(source, target, {transition})
         self._graph.add_edge(source, target, edge=edge)
+        self._version += 1
         return edge
 
+    @property
+    def index(self) -> StateSpaceIndex:
+        if self._index is None or self._index_version != self._version:
+            self._index = StateSpaceIndex(self)
+            self._index_version = self._version
+
+        return self._index
+
+    def count_paths(self, max_length: int, simple: bool = False,
+                    max_expansions: Optional[int] = None) -> Dict[int, int]:
+        """
+        Counts the mechanisms from the initial to the target node by length.
+        :param max_length: the maximal length of the counted mechanisms.
+        :param simple: only count mechanisms that do not revisit a state. All bounded-length mechanisms are counted
+            by dynamic programming in polynomial time without enumerating them, but the simple ones are enumerated by
+            a pruned depth-first search, which takes time exponential in `max_length`.
+        :param max_expansions: the budget of the enumeration of simple mechanisms, see
+            `StateSpaceIndex.count_simple_paths`.
+        :return: a dictionary mapping each length to the number of mechanisms of that length.
+        """
+        if simple:
+            return self.index.count_simple_paths(max_length, max_expansions)
+
+        return self.index.count_paths(max_length)
+
+    def remove_nodes(self, nodes: Iterable[StateSpaceNode]):
+        """
+        Removes the given nodes and their edges. The initial and target node are never removed. Nodes that lose an
+        edge are no longer expanded in the direction of the edge, so expanding them again finds all their transitions.
+        """
+        for node in nodes:
+            if node == self._initial_node or node == self._target_node or not self._graph.has_node(node):
+                continue
+
+            self._expanded_nodes.difference_update(self._graph.predecessors(node))
+            self._inverse_expanded_nodes.difference_update(self._graph.successors(node))
+            self._graph.remove_node(node)
+            self._version += 1
+            self._state2node.pop(node.state, None)
+            self._expanded_nodes.discard(node)
+            self._inverse_expanded_nodes.discard(node)
+
     def set_expansion_limit(self, limit: int):
         self._expansion_limit = limit
 
+    def set_state_filter(self, state_filter: Optional[Callable[[State], bool]]):
+        self._state_filter = state_filter
+
     def get_edge(self, source: StateSpaceNode, target: StateSpaceNode) -> StateSpaceEdge:
         return self._graph.edges[source, target]["edge"]
 
@@ -436,6 +498,41 @@ class StateSpace:
         print(f"\t{len(self._expanded_nodes)} states from the initial state and")
         print(f"\t{len(self._inverse_expanded_nodes)} states from the target state.")
 
+    def successors(self, state: State) -> Dict[State, Set[mod.DGHyperEdge]]:
+        """
+        The transitions from the state grouped by the state they lead to. Unlike `expand_node`, the states and
+        transitions are not added to the state space, see `add_transitions`. For frozen state spaces and expanded
+        states the stored transitions are returned.
+        """
+        node = self._state2node.get(state)
+        if self.is_frozen() or (node is not None and node in self._expanded_nodes):
+            if node is None:
+                return {}
+            return {edge.target.state: edge.transitions for edge in self.expand_node(node)}
+
+        successors: Dict[State, Set[mod.DGHyperEdge]] = {}
+        for transition in self._dg_expander.compute_derivations(state.graph_multiset):
+            target = state.fire(transition)
+            if target is None or (self._state_filter is not None and not self._state_filter(target)):
+                continue
+
+            successors.setdefault(target, set()).add(transition)
+
+        return successors
+
+    def add_transitions(self, source: State, target: State, transitions: Iterable[mod.DGHyperEdge]) -> StateSpaceEdge:
+        """Adds the states and the transitions between them, e.g., found through `successors`."""
+        source_node = self._state2node[source] if source in self._state2node else self._add_state(source)
+        target_node = self._state2node[target] if target in self._state2node else self._add_state(target)
+        if not self._graph.has_edge(source_node, target_node):
+            self._graph.add_edge(source_node, target_node, edge=StateSpaceEdge(source_node, target_node, ()))
+
+        edge = self.get_edge(source_node, target_node)
+        for transition in transitions:
+            edge.add_transition(transition)
+        self._version += 1
+        return edge
+
     def expand_node(self, node: StateSpaceNode,
                     inverse: bool = False, verbosity: int = 0) -> Iterable[StateSpaceEdge]:
         expanded_nodes = self._expanded_nodes if not inverse else self._inverse_expanded_nodes
@@ -468,7 +565,7 @@ class StateSpace:
             # print([g.graph.graphDFS for g in transition.sources], "->", [g.graph.graphDFS for g in transition.targets])
             # print(num_src_atoms, num_tar_atoms)
             # assert(num_src_atoms == num_tar_atoms)
-            if target is None:
+            if target is None or (self._state_filter is not None and not self._state_filter(target)):
                 continue
 
             if target not in self._state2node:
@@ -484,6 +581,7 @@ class StateSpace:
             if self._graph.has_edge(src, tar):
                 edge: StateSpaceEdge = self.get_edge(src, tar)
                 edge.add_transition(transition)
+                self._version += 1
                 yield edge
             else:
                 yield self._add_edge(src, tar, transition)
@@ -0,0 +1,123 @@
+from collections import deque
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mechsearch.state_space import StateSpace, StateSpaceEdge, StateSpaceNode
+
+
+class StateSpaceIndex:
+    """
+    Compact integer view of a (frozen) state space. Nodes are numbered 0..n-1 and the outgoing and incoming edges
+    of every node are stored in CSR form, i.e., the out-edges of node `v` are at positions
+    `out_offsets[v]:out_offsets[v + 1]` of `out_heads` and `out_edges`.
+    """
+
+    def __init__(self, state_space: 'StateSpace'):
+        self.nodes: List['StateSpaceNode'] = list(state_space.graph.nodes)
+        self.node_ids: Dict['StateSpaceNode', int] = {node: index for index, node in enumerate(self.nodes)}
+        self.source: int = self.node_ids[state_space.initial_node]
+        self.target: int = self.node_ids[state_space.target_node]
+
+        out_adjacency: List[List['StateSpaceEdge']] = [[] for _ in self.nodes]
+        in_adjacency: List[List[int]] = [[] for _ in self.nodes]
+        for source, target in state_space.graph.edges:
+            out_adjacency[self.node_ids[source]].append(state_space.get_edge(source, target))
+            in_adjacency[self.node_ids[target]].append(self.node_ids[source])
+
+        self.out_offsets: List[int] = [0]
+        self.out_heads: List[int] = []
+        self.out_edges: List['StateSpaceEdge'] = []
+        for edges in out_adjacency:
+            self.out_edges.extend(edges)
+            self.out_heads.extend(self.node_ids[edge.target] for edge in edges)
+            self.out_offsets.append(len(self.out_heads))
+
+        self.in_offsets: List[int] = [0]
+        self.in_tails: List[int] = []
+        for tails in in_adjacency:
+            self.in_tails.extend(tails)
+            self.in_offsets.append(len(self.in_tails))
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.out_heads)
+
+    def distances_to_target(self) -> List[int]:
+        """Number of edges on a shortest path from every node to the target, -1 if the target is unreachable."""
+        distance = [-1] * self.number_of_nodes
+        distance[self.target] = 0
+        queue = deque([self.target])
+        while queue:
+            v = queue.popleft()
+            for position in range(self.in_offsets[v], self.in_offsets[v + 1]):
+                u = self.in_tails[position]
+                if distance[u] < 0:
+                    distance[u] = distance[v] + 1
+                    queue.append(u)
+
+        return distance
+
+    def count_paths(self, max_length: int) -> Dict[int, int]:
+        """
+        Counts the paths of each length up to `max_length` from the source to the target that do not pass through
+        the target before their last edge. States may be revisited. Runs in O(max_length * |E|) time.
+        """
+        if self.source == self.target:
+            return {0: 1}
+
+        result: Dict[int, int] = {}
+        counts: List[int] = [0] * self.number_of_nodes
+        counts[self.source] = 1
+        for length in range(1, max_length + 1):
+            next_counts: List[int] = [0] * self.number_of_nodes
+            for v, count in enumerate(counts):
+                if count == 0 or v == self.target:
+                    continue
+
+                for position in range(self.out_offsets[v], self.out_offsets[v + 1]):
+                    next_counts[self.out_heads[position]] += count
+
+            if next_counts[self.target]:
+                result[length] = next_counts[self.target]
+            counts = next_counts
+
+        return result
+
+    def count_simple_paths(self, max_length: int, max_expansions: Optional[int] = None) -> Dict[int, int]:
+        """
+        Counts the simple paths of each length up to `max_length` from the source to the target. Counting simple
+        paths is #P-hard in general, so this is a depth-first enumeration of the paths, pruned by the distance of
+        each node to the target, that only keeps counts. Its running time is exponential in `max_length`.
+        :param max_expansions: if given, a RuntimeError is raised once the enumeration has visited this many nodes.
+        """
+        distance = self.distances_to_target()
+        result: Dict[int, int] = {}
+        if distance[self.source] < 0 or distance[self.source] > max_length:
+            return result
+
+        on_path: List[bool] = [False] * self.number_of_nodes
+        expansions = 0
+
+        def extend(v: int, length: int):
+            nonlocal expansions
+            expansions += 1
+            if max_expansions is not None and expansions > max_expansions:
+                raise RuntimeError(f"counting the simple paths exceeded {max_expansions} expansions")
+
+            if v == self.target:
+                result[length] = result.get(length, 0) + 1
+                return
+
+            on_path[v] = True
+            for position in range(self.out_offsets[v], self.out_offsets[v + 1]):
+                w = self.out_heads[position]
+                if not on_path[w] and 0 <= distance[w] <= max_length - length - 1:
+                    extend(w, length + 1)
+            on_path[v] = False
+
+        extend(self.source, 0)
+        return dict(sorted(result.items()))
@@ -0,0 +1,43 @@
+from mechsearch.edge_weight import ConstantEdgeWeight
+from mechsearch.explore import _bidirectional_dijkstra, _dijkstra, _reverse_shortest_path_tree, equal_weights
+import mechsearch.explore as explore
+from mechsearch.priority_queue import BucketQueue, IndexedHeap
+import scripts.rhea_analysis.util as util
+import sys
+import time
+
+# Compares the bucket queue and the indexed heap on the Dijkstra searches over a stored frozen state space.
+# Usage: python -m scripts.profile.priority_queues <mechanism_entry> [repetitions]
+
+
+def run(state_space, queue_type, repetitions: int):
+    explore.make_priority_queue = lambda weight: queue_type()
+    source, target = state_space.initial_node, state_space.target_node
+    timings = {}
+    for name, search in [("dijkstra", lambda: _dijkstra(state_space, source, target, equal_weights)),
+                         ("bidirectional_dijkstra",
+                          lambda: _bidirectional_dijkstra(state_space, source, target, ConstantEdgeWeight())),
+                         ("reverse_tree", lambda: _reverse_shortest_path_tree(state_space, target, equal_weights))]:
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            search()
+        timings[name] = (time.perf_counter() - start) / repetitions
+
+    return timings
+
+
+def main(mechanism_entry: str, repetitions: int = 10):
+    grammar = util.load_rules() + util.load_mechanism(mechanism_entry)
+    state_space = util.load_state_space(mechanism_entry, grammar)
+
+    make_priority_queue = explore.make_priority_queue
+    try:
+        for queue_type in [BucketQueue, IndexedHeap]:
+            for name, seconds in run(state_space, queue_type, repetitions).items():
+                print(f"{queue_type.__name__:>12} {name:>24}: {seconds * 1000:.2f} ms")
+    finally:
+        explore.make_priority_queue = make_priority_queue
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,69 @@
+from data.rhea.db import RheaDB
+from mechsearch.state_space import StateSpace
+from scripts.rhea_analysis.batch_runner import resident_memory
+import scripts.rhea_analysis.util as util
+import gc
+import multiprocessing as mp
+import os
+import sys
+import time
+
+# Measures the startup of a batch worker, i.e., the time and memory until it has built the (empty) state space of a
+# reaction, when every worker loads the rules itself and when workers are forked from a parent that has loaded and
+# prewarmed them.
+# Usage: python -m scripts.profile.worker_startup <rhea_id> [num_workers]
+
+
+def private_memory(pid: int) -> int:
+    """The memory in bytes that is not shared with other processes, e.g., the copy-on-write pages of the parent."""
+    total = 0
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Private_Clean:") or line.startswith("Private_Dirty:"):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def startup(grammar_rules, reaction, connection):
+    start = time.perf_counter()
+    if grammar_rules is None:
+        grammar_rules = util.load_rules()
+    StateSpace(grammar_rules + util.reaction2grammar(reaction))
+    connection.send((time.perf_counter() - start, resident_memory(os.getpid()), private_memory(os.getpid())))
+    connection.close()
+
+
+def measure(grammar_rules, reaction, num_workers: int):
+    context = mp.get_context("fork")
+    measurements = []
+    for _ in range(num_workers):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=startup, args=(grammar_rules, reaction, sender))
+        process.start()
+        sender.close()
+        measurements.append(receiver.recv())
+        process.join()
+
+    seconds, rss, private = (sum(values) / len(values) for values in zip(*measurements))
+    return seconds, rss, private
+
+
+def main(rhea_id: str, num_workers: int = 4):
+    reaction = RheaDB().get_reaction(rhea_id)
+    results = {"cold": measure(None, reaction, num_workers)}
+
+    start = time.perf_counter()
+    grammar_rules = util.load_rules()
+    grammar_rules.prewarm()
+    gc.collect()
+    gc.freeze()
+    print(f"Parent load and prewarm: {time.perf_counter() - start:.2f}s")
+    results["prewarmed"] = measure(grammar_rules, reaction, num_workers)
+
+    for mode, (seconds, rss, private) in results.items():
+        print(f"{mode:>10}: startup {seconds:.3f}s, RSS {rss / 2 ** 20:.1f} MiB, "
+              f"private {private / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 4)
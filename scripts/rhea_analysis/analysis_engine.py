@@ -0,0 +1,257 @@
+from data.rhea.db import RheaDB
+from mechsearch.archive import state_space_from_dump
+from mechsearch.constraints import Constraint, ConstrainedStateSpace
+from mechsearch.grammar import Grammar
+from mechsearch.graph import Rule
+from mechsearch.state_space import Path, StateSpace
+import mechsearch.explore as explore
+import scripts.rhea_analysis.util as util
+import mod
+import gc
+import itertools
+import json
+import multiprocessing as mp
+import sys
+import time
+import traceback
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+# entry state of a query once enough entries are used, not a bitmap (and unlike `True` not equal to the bitmap 1)
+_enough_entries: int = -1
+
+
+def _popcount(bitmap: int) -> int:
+    return bin(bitmap).count("1")
+
+
+class TransitionFeatures:
+    """
+    Features of a transition, or of a set of transitions, as bitmaps. Bit i of `entries` is the i-th MCSA entry and
+    bit i of `rules` is the i-th rule of the feature table.
+    """
+
+    def __init__(self, uses_amino: bool = False, entries: int = 0, rules: int = 0):
+        self.uses_amino: bool = uses_amino
+        self.entries: int = entries
+        self.rules: int = rules
+
+    def __or__(self, other: 'TransitionFeatures') -> 'TransitionFeatures':
+        return TransitionFeatures(self.uses_amino or other.uses_amino, self.entries | other.entries,
+                                  self.rules | other.rules)
+
+
+class FeatureTable:
+    """
+    The rule and MCSA entry bitmaps of every rule of a grammar, computed once for the whole corpus, and the features
+    of the transitions of the derivation graph currently analysed, computed at most once per transition. A transition
+    uses an amino acid if one of its sources contains an amino acid vertex, which is determined once per graph.
+    """
+
+    def __init__(self, grammar_rules: Grammar):
+        self._rules: List[Rule] = list(grammar_rules.rules)
+        self._entries: List[int] = sorted({step.entry for rule in self._rules for step in rule.steps})
+        entry_bits = {entry: 1 << i for i, entry in enumerate(self._entries)}
+
+        self._rule_features: Dict[mod.Rule, TransitionFeatures] = {}
+        for i, rule in enumerate(self._rules):
+            entries = 0
+            for step in rule.steps:
+                entries |= entry_bits[step.entry]
+            self._rule_features[rule.rule] = TransitionFeatures(False, entries, 1 << i)
+
+        self._uses_amino: Dict[int, bool] = {}
+        self._transitions: Dict[mod.DGHyperEdge, TransitionFeatures] = {}
+
+    def reset(self):
+        """Forgets the features of the transitions and graphs, e.g., before the next derivation graph is analysed."""
+        self._uses_amino.clear()
+        self._transitions.clear()
+
+    def _graph_uses_amino(self, graph: mod.Graph) -> bool:
+        if graph.id not in self._uses_amino:
+            self._uses_amino[graph.id] = any(vertex.stringLabel.startswith("Amino") for vertex in graph.vertices)
+
+        return self._uses_amino[graph.id]
+
+    def features(self, transition: mod.DGHyperEdge) -> TransitionFeatures:
+        if transition not in self._transitions:
+            features = TransitionFeatures(any(self._graph_uses_amino(source.graph) for source in transition.sources))
+            for rule in transition.rules:
+                if rule in self._rule_features:
+                    features = features | self._rule_features[rule]
+            self._transitions[transition] = features
+
+        return self._transitions[transition]
+
+    def path_features(self, path: Path) -> TransitionFeatures:
+        features = TransitionFeatures()
+        for edge in path:
+            for transition in edge.transitions:
+                features = features | self.features(transition)
+
+        return features
+
+    def rule_bitmap(self, rules: Iterable[Rule]) -> int:
+        bitmap = 0
+        for rule in rules:
+            bitmap |= self._rule_features[rule.rule].rules
+        return bitmap
+
+    def entries_of(self, bitmap: int) -> List[int]:
+        return [entry for i, entry in enumerate(self._entries) if bitmap >> i & 1]
+
+    def rules_of(self, bitmap: int) -> List[Rule]:
+        return [rule for i, rule in enumerate(self._rules) if bitmap >> i & 1]
+
+
+class FeatureQuery(Constraint):
+    """
+    Mechanisms using an amino acid if `uses_amino`, rules derived from at least `min_entries` different MCSA entries
+    and none of the `forbidden_rules`, evaluated on the bitmaps of a feature table. The state is whether an amino acid
+    was used and the bitmap of the entries used so far, which collapses once `min_entries` are used.
+    """
+
+    def __init__(self, table: FeatureTable, uses_amino: bool = True, min_entries: int = 2,
+                 forbidden_rules: Iterable[Rule] = ()):
+        self._table: FeatureTable = table
+        self._uses_amino: bool = uses_amino
+        self._min_entries: int = min_entries
+        self._forbidden: int = table.rule_bitmap(forbidden_rules)
+
+    @property
+    def initial(self):
+        return not self._uses_amino, _enough_entries if self._min_entries <= 0 else 0
+
+    def step(self, state, transition: mod.DGHyperEdge):
+        features = self._table.features(transition)
+        if features.rules & self._forbidden:
+            return None
+
+        uses_amino, entries = state
+        if entries != _enough_entries:
+            entries |= features.entries
+            if _popcount(entries) >= self._min_entries:
+                entries = _enough_entries
+
+        return uses_amino or features.uses_amino, entries
+
+    def accepting(self, state) -> bool:
+        return state[0] and state[1] == _enough_entries
+
+
+class AnalysisEngine:
+    """
+    Runs a path query on the stored state spaces of the RHEA reactions, by default the shortest mechanism using an
+    amino acid and rules from two different MCSA entries as in `print_paths.print_interesting_paths`. The grammar
+    and the rule bitmaps are prepared once, and `run` analyses the reactions in forked worker processes that inherit
+    them, streaming the summary of every reaction to a JSON lines file as soon as it is done.
+    """
+
+    def __init__(self, root_dir: str, amino_path: str = "data/amino_acids.json", num_paths: int = 1,
+                 uses_amino: bool = True, min_entries: int = 2, forbidden_rules: Iterable[Rule] = ()):
+        grammar_aminos = Grammar()
+        grammar_aminos.load_file(amino_path)
+        self._grammar_rules: Grammar = grammar_aminos + util.load_rules()
+        self._root_dir: str = root_dir
+        self._num_paths: int = num_paths
+        self._rhea_db: RheaDB = RheaDB()
+        self._table: FeatureTable = FeatureTable(self._grammar_rules)
+        self._query: FeatureQuery = FeatureQuery(self._table, uses_amino, min_entries, forbidden_rules)
+
+    @property
+    def table(self) -> FeatureTable:
+        return self._table
+
+    @property
+    def root_dir(self) -> str:
+        return self._root_dir
+
+    def reaction_grammar(self, rhea_id: str) -> Grammar:
+        return self._grammar_rules + util.reaction2grammar(self._rhea_db.get_reaction(rhea_id))
+
+    def load(self, rhea_id: str) -> StateSpace:
+        state_space = util.load_stored_state_space(self._root_dir, rhea_id, self.reaction_grammar(rhea_id))
+        state_space.freeze()
+        return state_space
+
+    def load_dump(self, rhea_id: str, state_space_json: Dict[str, Any], dg_dump: bytes) -> StateSpace:
+        """Loads the state space of the reaction from the contents of its files, see `util.read_stored_state_space`."""
+        state_space = state_space_from_dump(state_space_json, dg_dump, self.reaction_grammar(rhea_id))
+        state_space.freeze()
+        return state_space
+
+    def summarise(self, path: Path) -> Dict[str, Any]:
+        features = self._table.path_features(path)
+        return {"length": len(path),
+                "rules": [sorted(rule.name for transition in edge.transitions for rule in transition.rules)
+                          for edge in path],
+                "entries": self._table.entries_of(features.entries),
+                "uses_amino": features.uses_amino}
+
+    def search(self, rhea_id: str, state_space: StateSpace) -> Dict[str, Any]:
+        self._table.reset()
+        constrained_space = ConstrainedStateSpace(state_space, self._query)
+        paths = explore.shortest_simple_paths(constrained_space, algorithm="bidirectional_dijkstra")
+        return {"rhea_id": rhea_id,
+                "num_states": state_space.number_of_states,
+                "num_edges": state_space.num_edges,
+                "paths": [self.summarise(path) for path in itertools.islice(paths, self._num_paths)]}
+
+    def analyse(self, rhea_id: str) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            result = self.search(rhea_id, self.load(rhea_id))
+        except Exception:
+            result = {"rhea_id": rhea_id, "error": traceback.format_exc()}
+        result["runtime"] = time.monotonic() - start
+        return result
+
+    def results(self, rhea_ids: Optional[Iterable[str]] = None, num_workers: Optional[int] = None,
+                max_tasks_per_worker: Optional[int] = 100) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the summary of every reaction in the order they finish.
+        :param rhea_ids: the reactions to analyse, by default all stored reactions.
+        :param num_workers: the number of worker processes, defaults to the number of cores.
+        :param max_tasks_per_worker: workers are replaced after this many reactions, bounding the memory held by the
+            derivation graphs they loaded.
+        """
+        global _engine
+        rhea_ids = list(rhea_ids) if rhea_ids is not None else util.stored_reaction_ids(self._root_dir)
+        _engine = self
+        # keep the collector from touching, and thereby copying, the pages shared with the workers
+        gc.collect()
+        gc.freeze()
+        try:
+            with mp.get_context("fork").Pool(num_workers, maxtasksperchild=max_tasks_per_worker) as pool:
+                yield from pool.imap_unordered(_analyse, rhea_ids)
+        finally:
+            gc.unfreeze()
+            _engine = None
+
+    def run(self, output_path: str, rhea_ids: Optional[Iterable[str]] = None,
+            num_workers: Optional[int] = None) -> Dict[str, int]:
+        """Writes the summary of every reaction to `output_path` as a JSON line and returns the number per outcome."""
+        counts = {"paths": 0, "no_paths": 0, "errors": 0}
+        with open(output_path, "w") as f:
+            for result in self.results(rhea_ids, num_workers):
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+                outcome = "errors" if "error" in result else "paths" if result["paths"] else "no_paths"
+                counts[outcome] += 1
+
+        return counts
+
+
+# the engine of the supervising process, inherited by the forked workers
+_engine: Optional[AnalysisEngine] = None
+
+
+def _analyse(rhea_id: str) -> Dict[str, Any]:
+    return _engine.analyse(rhea_id)
+
+
+if __name__ == "__main__":
+    # python -m scripts.rhea_analysis.analysis_engine <root_dir> <output.jsonl> [num_workers]
+    engine = AnalysisEngine(sys.argv[1])
+    print(engine.run(sys.argv[2], num_workers=int(sys.argv[3]) if len(sys.argv) > 3 else None))
@@ -0,0 +1,323 @@
+import gc
+import json
+import multiprocessing as mp
+import os
+import resource
+import shutil
+import tempfile
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+# statuses of tasks that are not run again when a batch is restarted
+finished_statuses: Set[str] = {"completed", "timed_out", "out_of_memory", "failed"}
+
+# seconds a worker that has reported its result is given to exit by itself
+exit_grace_period: float = 10.0
+
+
+class Task:
+    def __init__(self, key: str, payload: Any = None, features: Optional[Dict[str, float]] = None,
+                 dependencies: Optional[Dict[str, Any]] = None):
+        self.key: str = key
+        self.payload: Any = payload
+        # recorded in the manifest, e.g., to fit a cost model on
+        self.features: Optional[Dict[str, float]] = features
+        # JSON serialisable digests of the inputs of the task, a finished task is run again when they change
+        self.dependencies: Optional[Dict[str, Any]] = dependencies
+
+
+class Manifest:
+    """
+    Append-only JSON lines file recording the outcome of every task of a batch. When a task occurs several times,
+    e.g., because it was retried after a restart, its last record is the valid one.
+    """
+
+    def __init__(self, path: str):
+        self._path: str = path
+        self._records: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a torn last line of an interrupted batch
+                        continue
+                    self._records[record["key"]] = record
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def records(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._records)
+
+    def status(self, key: str) -> Optional[str]:
+        return self._records[key]["status"] if key in self._records else None
+
+    def append(self, record: Dict[str, Any]):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self._path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._records[record["key"]] = record
+
+
+@contextmanager
+def atomic_directory(path: str) -> Iterator[str]:
+    """
+    Yields a temporary directory next to `path` to write results to, which replaces `path` once the block completes.
+    Readers hence only ever see either no result or a complete one.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.", dir=parent)
+    try:
+        yield temporary
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(temporary, path)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+
+def resident_memory(pid: int) -> int:
+    """The resident set size of the process in bytes, 0 if it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _run_task(function: Callable[[str, Any], Optional[Dict[str, Any]]], task: Task, connection):
+    # the memory budget is enforced by the supervisor on the resident memory, an address space limit would also count
+    # the mappings inherited from the supervisor, e.g. the MOD library and the prewarmed grammar
+    try:
+        info = function(task.key, task.payload)
+        connection.send({"status": "completed", "info": info if info is not None else {}})
+    except MemoryError:
+        connection.send({"status": "out_of_memory"})
+    except Exception:
+        connection.send({"status": "failed", "error": traceback.format_exc()})
+    finally:
+        connection.close()
+
+
+class _RunningTask:
+    def __init__(self, task: Task, process: mp.Process, connection):
+        self.task: Task = task
+        self.process: mp.Process = process
+        self.connection = connection
+        self.start: float = time.monotonic()
+        self.peak_memory: int = 0
+        # the result reported by the worker and when, the worker is then given time to exit by itself
+        self.result: Optional[Dict[str, Any]] = None
+        self.reported: Optional[float] = None
+
+
+class BatchRunner:
+    """
+    Runs a function on a batch of tasks, each in its own forked worker process with at most `num_workers` running
+    at the same time. The supervisor kills workers exceeding the wall-clock budget `time_limit` (seconds) or the
+    resident memory budget `memory_limit` (bytes), and records the outcome of every task in a manifest. Tasks with a
+    finished status in the manifest are skipped, so an interrupted batch is resumed by running it again. Tasks may
+    declare dependencies, in which case finished tasks are only run again if their recorded dependencies differ.
+    The finished statuses include "failed", "timed_out" and "out_of_memory", so tasks that failed or exceeded a budget
+    are not run again on a restart unless their status is given in `retry`, e.g. `retry=["failed"]`.
+
+    Workers are forked from the supervisor, hence they inherit everything loaded before `run` is called, e.g., a
+    grammar prepared by `Grammar.prewarm`, and neither the function nor the tasks need to be picklable. The function
+    is called as `function(key, payload)` and may return a JSON serialisable dictionary, which is stored in the
+    manifest.
+
+    If `on_completed` is given, the supervisor calls it as `on_completed(key, info)` on the info of every completed
+    task before recording it, e.g., to commit a result the worker staged, and records the info it returns. If it
+    raises, the task is recorded as failed instead.
+    """
+
+    def __init__(self, function: Callable[[str, Any], Optional[Dict[str, Any]]], manifest_path: str,
+                 num_workers: Optional[int] = None, time_limit: Optional[float] = None,
+                 memory_limit: Optional[int] = None, retry: Iterable[str] = (),
+                 ignored_dependencies: Iterable[str] = (), poll_interval: float = 0.05, verbose: bool = True,
+                 on_completed: Optional[Callable[[str, Dict[str, Any]], Dict[str, Any]]] = None):
+        self._function = function
+        self._manifest: Manifest = Manifest(manifest_path)
+        self._num_workers: int = num_workers if num_workers is not None else os.cpu_count()
+        self._time_limit: Optional[float] = time_limit
+        self._memory_limit: Optional[int] = memory_limit
+        self._retry: Set[str] = set(retry)
+        self._ignored_dependencies: Set[str] = set(ignored_dependencies)
+        self._poll_interval: float = poll_interval
+        self._verbose: bool = verbose
+        self._on_completed = on_completed
+        self._context = mp.get_context("fork")
+
+    @property
+    def manifest(self) -> Manifest:
+        return self._manifest
+
+    def invalidation(self, task: Task) -> Optional[str]:
+        """
+        Returns why the task has to be run, or `None` if it has a finished record whose dependencies, apart from
+        the ignored ones, equal those of the task.
+        """
+        status = self._manifest.status(task.key)
+        if status is None:
+            return "new"
+
+        if status not in finished_statuses or status in self._retry:
+            return status
+
+        if task.dependencies is not None:
+            recorded = self._manifest.records[task.key].get("dependencies", {})
+            changed = [name for name, value in task.dependencies.items() if
+                       name not in self._ignored_dependencies and recorded.get(name) != value]
+            if changed:
+                return f"changed {', '.join(changed)}"
+
+        return None
+
+    def plan(self, tasks: Iterable[Task]) -> Dict[str, str]:
+        """Maps the key of every task that `run` would run to the reason it has to be run."""
+        invalidations: Dict[str, str] = {}
+        for task in tasks:
+            reason = self.invalidation(task)
+            if reason is not None:
+                invalidations[task.key] = reason
+
+        return invalidations
+
+    def _start(self, task: Task) -> _RunningTask:
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_task, args=(self._function, task, sender),
+                                        name=f"worker-{task.key}", daemon=True)
+        process.start()
+        sender.close()
+        return _RunningTask(task, process, receiver)
+
+    def _finish(self, running: _RunningTask, result: Dict[str, Any]):
+        if running.process.is_alive():
+            running.process.kill()
+        running.process.join()
+        running.connection.close()
+
+        if result["status"] == "completed" and self._on_completed is not None:
+            try:
+                result = {"status": "completed", "info": self._on_completed(running.task.key, result["info"])}
+            except Exception:
+                result = {"status": "failed", "error": traceback.format_exc()}
+
+        end = running.reported if running.reported is not None else time.monotonic()
+        record = {"key": running.task.key, "runtime": end - running.start,
+                  "peak_memory": running.peak_memory}
+        if running.task.features is not None:
+            record["features"] = running.task.features
+        if running.task.dependencies is not None:
+            record["dependencies"] = running.task.dependencies
+        record.update(result)
+        self._manifest.append(record)
+        if self._verbose:
+            print(f"{record['status']}: {running.task.key} ({record['runtime']:.1f}s)")
+
+    def _poll(self, running: _RunningTask) -> bool:
+        """Finishes the task if it has ended or exceeded a budget and returns whether it did."""
+        if running.result is None and running.connection.poll():
+            try:
+                running.result = running.connection.recv()
+            except EOFError:
+                running.result = {"status": "failed", "error": f"worker exited with code {running.process.exitcode}"}
+            running.reported = time.monotonic()
+
+        if running.result is not None:
+            # let the worker exit by itself for a while before it is killed, without blocking the other workers
+            if running.process.is_alive() and time.monotonic() - running.reported < exit_grace_period:
+                return False
+
+            self._finish(running, running.result)
+            return True
+
+        if not running.process.is_alive():
+            # e.g., killed by the kernel before it could report
+            running.process.join()
+            self._finish(running, {"status": "failed",
+                                   "error": f"worker exited with code {running.process.exitcode}"})
+            return True
+
+        running.peak_memory = max(running.peak_memory, resident_memory(running.process.pid))
+        if self._memory_limit is not None and running.peak_memory > self._memory_limit:
+            self._finish(running, {"status": "out_of_memory"})
+            return True
+
+        if self._time_limit is not None and time.monotonic() - running.start > self._time_limit:
+            self._finish(running, {"status": "timed_out"})
+            return True
+
+        return False
+
+    def run(self, tasks: Iterable[Task], cost: Optional[Callable[[Task], float]] = None,
+            dry_run: bool = False) -> Dict[str, int]:
+        """
+        Runs all unfinished or invalidated tasks and returns the number of tasks of this batch per status, including
+        those finished by earlier runs.
+        :param tasks: the tasks of the batch.
+        :param cost: the expected cost of a task. If given, the tasks are started by decreasing cost, otherwise in the
+            given order. Idle workers always take the next task, so expensive tasks do not end up in the tail.
+        :param dry_run: only report the tasks that would be run and why, and return their number per reason.
+        """
+        tasks = list(tasks)
+        keys: List[str] = [task.key for task in tasks]
+        invalidations = self.plan(tasks)
+        pending: List[Task] = [task for task in tasks if task.key in invalidations]
+
+        if dry_run:
+            reasons: Dict[str, int] = {}
+            for key, reason in invalidations.items():
+                print(f"{key}: {reason}")
+                reasons[reason] = reasons.get(reason, 0) + 1
+            print(f"{len(invalidations)}/{len(keys)} tasks would be run")
+            return reasons
+
+        if cost is not None:
+            pending.sort(key=cost, reverse=True)
+
+        if self._verbose:
+            print(f"Running {len(pending)}/{len(keys)} tasks on {self._num_workers} workers")
+
+        # objects loaded so far are shared with the forked workers, keep the collector from touching (and thereby
+        # copying) their pages in every worker
+        gc.collect()
+        gc.freeze()
+
+        pending.reverse()
+        running: List[_RunningTask] = []
+        try:
+            while pending or running:
+                while pending and len(running) < self._num_workers:
+                    running.append(self._start(pending.pop()))
+
+                running = [task for task in running if not self._poll(task)]
+                if running:
+                    time.sleep(self._poll_interval)
+        finally:
+            for task in running:
+                task.process.kill()
+                task.process.join()
+            gc.unfreeze()
+
+        counts: Dict[str, int] = {}
+        for key in keys:
+            status = self._manifest.status(key)
+            counts[status] = counts.get(status, 0) + 1
+        return counts
@@ -3,69 +3,79 @@ from mechsearch.grammar import Grammar
 from mechsearch.state_space import StateSpace
 import mechsearch.explore as explore
 import mechsearch.enzyme_planner as enzyme_planner
+from mechsearch.archive import ArchiveWriter, StateSpaceArchive
+from mechsearch.result_cache import StateSpaceCache
+from scripts.rhea_analysis.batch_runner import BatchRunner, Task, atomic_directory
+from scripts.rhea_analysis.cost_model import CostModel, reaction_features
+from scripts.rhea_analysis.dependencies import BatchDependencies, ignored_dependencies
 import scripts.rhea_analysis.util as util
 import mod
+import functools
 import os
-import shutil
 import json
-import multiprocessing as mp
-from typing import List
-import signal
-import sys
+from typing import Any, Dict, List, Optional
 
+# budgets of a single reaction
+time_limit: int = 180
+memory_limit: int = 16 * 2 ** 30
 
-def timeout(seconds_before_timeout):
-    def decorate(f):
-        def handler(signum, frame):
-            raise TimeoutError()
 
-        def new_f(*args, **kwargs):
-            old = signal.signal(signal.SIGALRM, handler)
-            signal.alarm(seconds_before_timeout)
-            try:
-                result = f(*args, **kwargs)
-            finally:
-                # reinstall the old signal handler
-                signal.signal(signal.SIGALRM, old)
-                # cancel the alarm
-                # this line should be inside the "finally" block (per Sam Kortchmar)
-                signal.alarm(0)
-            return result
+def store_reaction_state_space(reaction: RheaDB.Reaction, state_space: StateSpace,
+                               root_dir="state_space", writer: Optional[ArchiveWriter] = None) -> Optional[str]:
+    """
+    Stores the state space under "root_dir/RHEA_ID/", or stages it for the archive of `writer` and returns the path
+    of the staged entry, which the supervisor commits with `commit_archive_entry`.
+    """
+    state_space.freeze()
+    if writer is not None:
+        return writer.stage(reaction.rhea_id, state_space)
 
-        new_f.__name__ = f.__name__
-        return new_f
+    out_dir = f"{root_dir}/{reaction.rhea_id}"
 
-    return decorate
+    # the state space of a reaction is written at once, such that an interrupted run never leaves a partial result
+    with atomic_directory(out_dir) as tmp_dir:
+        # MOD's default dump names come from a counter that forked workers inherit, so they may collide
+        state_space.derivation_graph.dump(os.path.join(tmp_dir, "dg.dg"))
 
+        with open(os.path.join(tmp_dir, "state_space.json"), "w") as f:
+            json.dump(state_space.to_json(), f, indent=2)
 
-def timeout_handler(signum, frame):
-    print("Timed Out")
-    raise Exception("end of time")
+    return None
 
 
-def store_reaction_state_space(reaction: RheaDB.Reaction, state_space: StateSpace,
-                               root_dir="state_space"):
-    state_space.freeze()
-    out_dir = f"{root_dir}/{reaction.rhea_id}"
+def commit_archive_entry(writer: ArchiveWriter, rhea_id: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    """Appends the entry staged by the worker of the reaction, if any, to the archive before it is recorded."""
+    info = dict(info)
+    entry_path = info.pop("archive_entry", None)
+    if entry_path is not None:
+        writer.commit(entry_path)
+
+    return info
 
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
 
-    dg_dump_path = state_space.derivation_graph.dump()
-    shutil.move(dg_dump_path, os.path.join(out_dir, "dg.dg"))
+def batch_tasks(reactions: List[RheaDB.Reaction], grammar_rules: Grammar, amino_sets: List[List[mod.Graph]],
+                parameters: Dict[str, Any]) -> List[Task]:
+    """The task of every reaction with its features and dependencies, which share the candidate rule queries."""
+    dependencies = BatchDependencies(grammar_rules, parameters)
+    tasks: List[Task] = []
+    for reaction in reactions:
+        candidate_sets = dependencies.candidate_sets(reaction.reactants, amino_sets)
+        tasks.append(Task(reaction.rhea_id, reaction,
+                          reaction_features(grammar_rules, reaction.reactants, amino_sets, candidate_sets),
+                          dependencies.dependencies(reaction.reactants, reaction.products, amino_sets,
+                                                    candidate_sets)))
 
-    with open(os.path.join(out_dir, "state_space.json"), "w") as f:
-        json.dump(state_space.to_json(), f, indent=2)
+    return tasks
 
 
-@timeout(180)
 def compute_state_space(grammar, amino_graphs, k=1,
-                        verbose=False):
+                        verbose=False, cache: Optional[StateSpaceCache] = None):
     return enzyme_planner.compute_state_space(grammar, amino_graphs, max_depth=6, max_used_aminos=k,
-                                              verbose=verbose)
+                                              verbose=verbose, cache=cache)
 
 
-def find_all_state_spaces_with_aminos(aminos: List[mod.Graph], root_dir: str):
+def find_all_state_spaces_with_aminos(aminos: List[mod.Graph], root_dir: str, num_workers: Optional[int] = None,
+                                      archive: bool = False, dry_run: bool = False):
     """
     Computes all states spaces that uses the list of given amino acids for
     each rhea reaction. Each state space for each reaction is combined
@@ -73,47 +83,69 @@ def find_all_state_spaces_with_aminos(aminos: List[mod.Graph], root_dir: str):
     the combined state space is stored under "root_dir/RHEA_ID/state_space.json".
     Its underlying reaction network is stored in "root_dir/RHEA_ID/dg.dg".
 
-    The time limit for computing the state spaces of each reaction
-    is 180 seconds.
+    The reactions are computed in parallel, and the time limit for computing
+    the state spaces of each reaction is 180 seconds. The outcome of each
+    reaction is recorded in "root_dir/manifest.jsonl" together with its
+    dependencies. When the computation is restarted, reactions recorded there
+    are skipped unless the reaction, the parameters or the rules applicable to
+    it have changed.
 
     :param aminos: the amino acids to place in the reactant and product state.
     :param root_dir: The directory path to store the computed state spaces.
+    :param num_workers: the number of reactions computed at the same time, defaults to the number of cores.
+    :param archive: store the state spaces in the single file "root_dir/state_spaces.archive" instead.
+    :param dry_run: only report which reactions would be recomputed and why.
     :return:
     """
 
-    @timeout(180)
-    def find_bfs_state_space(state_space: StateSpace):
-        explore.bidirectional_bfs(state_space, 6, verbose=True)
-
     grammar_rules = util.load_rules()
+    # computed once here and inherited by every worker
+    grammar_rules.prewarm()
     rhea_db = RheaDB()
     reactions: List[RheaDB.Reaction] = list(rhea_db.reactions())
 
-    num_timed_out_reactions: int = 0
-
-    for i, reaction in enumerate(reactions):
+    # the workers stage their state spaces for a single writer of the archive in the supervisor
+    writer = ArchiveWriter(StateSpaceArchive(os.path.join(root_dir, util.archive_file_name))) if archive else None
 
-        print(f"Process {mp.current_process().pid}: {i}/{len(reactions)}")
+    def run_reaction(rhea_id: str, reaction: RheaDB.Reaction):
         grammar_reaction = util.reaction2grammar(reaction)
         grammar = grammar_rules + grammar_reaction
         grammar.append_initial(aminos)
         grammar.append_target(aminos)
-        try:
-            state_space: StateSpace = StateSpace(grammar)
-            find_bfs_state_space(state_space)
-            state_space = enzyme_planner.prune_state_space(state_space)
-            print(state_space)
-            if state_space.num_edges > 0:
-                store_reaction_state_space(reaction, state_space, root_dir)
-            del state_space
-        except TimeoutError as error:
-            num_timed_out_reactions += 1
-            print("State Space Computation Timed Out...")
-
-    print(f"{num_timed_out_reactions}/{len(reactions)} timed out...")
-
-
-def compute_state_spaces_with_1_amino(root_dir: str):
+        state_space: StateSpace = StateSpace(grammar)
+        explore.bidirectional_bfs(state_space, 6)
+        state_space = enzyme_planner.prune_state_space(state_space)
+        info = {"num_states": state_space.number_of_states, "num_edges": state_space.num_edges}
+        if state_space.num_edges > 0:
+            entry_path = store_reaction_state_space(reaction, state_space, root_dir, writer)
+            if entry_path is not None:
+                info["archive_entry"] = entry_path
+        return info
+
+    runner = BatchRunner(run_reaction, os.path.join(root_dir, "manifest.jsonl"), num_workers,
+                         time_limit=time_limit, memory_limit=memory_limit, ignored_dependencies=ignored_dependencies,
+                         on_completed=functools.partial(commit_archive_entry, writer) if writer is not None else None)
+    # the most expensive reactions are started first, such that they do not dominate the tail of the batch
+    cost_model = CostModel.from_manifests([runner.manifest])
+    parameters = {"function": "find_all_state_spaces_with_aminos", "max_depth": 6}
+    tasks = batch_tasks(reactions, grammar_rules, [aminos], parameters)
+    if dry_run:
+        runner.run(tasks, dry_run=True)
+        return
+
+    if writer is not None:
+        writer.start()
+    try:
+        counts = runner.run(tasks, cost=cost_model.expected_runtime)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"{counts.get('timed_out', 0)}/{len(reactions)} timed out...")
+
+
+def compute_state_spaces_with_1_amino(root_dir: str, num_workers: Optional[int] = None, archive: bool = False,
+                                      dry_run: bool = False, cache: Optional[StateSpaceCache] = None):
     """
     Computes all states spaces that uses a single amino acid for
     each rhea reaction. Each state space for each reaction is combined
@@ -121,10 +153,18 @@ def compute_state_spaces_with_1_amino(root_dir: str):
     the combined state space is stored under "root_dir/RHEA_ID/state_space.json".
     Its underlying reaction network is stored in "root_dir/RHEA_ID/dg.dg".
 
-    The time limit for computing the state spaces of each reaction
-    is 180 seconds.
+    The reactions are computed in parallel, and the time limit for computing
+    the state spaces of each reaction is 180 seconds. The outcome of each
+    reaction is recorded in "root_dir/manifest.jsonl" together with its
+    dependencies. When the computation is restarted, reactions recorded there
+    are skipped unless the reaction, the parameters or the rules applicable to
+    it have changed.
 
     :param root_dir: The directory path to store the computed state spaces.
+    :param num_workers: the number of reactions computed at the same time, defaults to the number of cores.
+    :param archive: store the state spaces in the single file "root_dir/state_spaces.archive" instead.
+    :param dry_run: only report which reactions would be recomputed and why.
+    :param cache: reuse state spaces computed before for the same inputs, and store the new ones in it.
     :return:
     """
 
@@ -134,27 +174,47 @@ def compute_state_spaces_with_1_amino(root_dir: str):
     amino_graphs = [graph.graph for graph in grammar_aminos.graphs]
     print(f"Loaded {len(amino_graphs)} amino graphs.")
     rhea_db = RheaDB()
-    # reactions: List[RheaDB.Reaction] = list(rhea_db.reactions())[441:][167:][434:][2016:]
     reactions: List[RheaDB.Reaction] = list(rhea_db.reactions())
 
     grammar_rules = util.load_rules()
-    num_timed_out_reactions: int = 0
+    # computed once here and inherited by every worker
+    grammar_rules.prewarm()
+
+    # the workers stage their state spaces for a single writer of the archive in the supervisor
+    writer = ArchiveWriter(StateSpaceArchive(os.path.join(root_dir, util.archive_file_name))) if archive else None
 
-    for i, reaction in enumerate(reactions):
-        print(f"Process {mp.current_process().pid}: {i}/{len(reactions)}, {reaction.rhea_id}")
+    def run_reaction(rhea_id: str, reaction: RheaDB.Reaction):
         grammar_reaction = util.reaction2grammar(reaction)
         grammar = grammar_rules + grammar_reaction
-        try:
-            state_space: StateSpace = compute_state_space(grammar, amino_graphs, k=1, verbose=True)
-            if state_space.num_edges > 0:
-                store_reaction_state_space(reaction, state_space, root_dir)
-            del state_space
-        except TimeoutError as error:
-            num_timed_out_reactions += 1
-            print("State Space Computation Timed Out...")
-            # sys.exit()
-
-    print(f"{num_timed_out_reactions}/{len(reactions)} timed out...")
+        state_space: StateSpace = compute_state_space(grammar, amino_graphs, k=1, cache=cache)
+        info = {"num_states": state_space.number_of_states, "num_edges": state_space.num_edges}
+        if state_space.num_edges > 0:
+            entry_path = store_reaction_state_space(reaction, state_space, root_dir, writer)
+            if entry_path is not None:
+                info["archive_entry"] = entry_path
+        return info
+
+    runner = BatchRunner(run_reaction, os.path.join(root_dir, "manifest.jsonl"), num_workers,
+                         time_limit=time_limit, memory_limit=memory_limit, ignored_dependencies=ignored_dependencies,
+                         on_completed=functools.partial(commit_archive_entry, writer) if writer is not None else None)
+    # the most expensive reactions are started first, such that they do not dominate the tail of the batch
+    cost_model = CostModel.from_manifests([runner.manifest])
+    amino_sets = [[amino] for amino in amino_graphs]
+    parameters = {"function": "compute_state_spaces_with_1_amino", "max_depth": 6, "max_used_aminos": 1}
+    tasks = batch_tasks(reactions, grammar_rules, amino_sets, parameters)
+    if dry_run:
+        runner.run(tasks, dry_run=True)
+        return
+
+    if writer is not None:
+        writer.start()
+    try:
+        counts = runner.run(tasks, cost=cost_model.expected_runtime)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"{counts.get('timed_out', 0)}/{len(reactions)} timed out...")
 
 
 if __name__ == "__main__":
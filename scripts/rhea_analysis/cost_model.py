@@ -0,0 +1,146 @@
+from mechsearch.atom_spectrum import AtomSpectrum
+from mechsearch.grammar import Grammar
+from mechsearch.graph import Rule
+from scripts.rhea_analysis.batch_runner import Manifest, Task
+import mod
+import heapq
+import math
+import numpy as np
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+feature_names: List[str] = ["reactants", "atoms", "candidate_rules", "amino_sets"]
+
+
+def reaction_features(grammar_rules: Grammar, reactants: Sequence[mod.Graph],
+                      amino_sets: Sequence[Sequence[mod.Graph]],
+                      candidate_sets: Optional[Sequence[Sequence[Rule]]] = None) -> Dict[str, float]:
+    """
+    Cheap features of the computation of a reaction, which constructs a state space for each of the amino acid sets.
+    The candidate rules are the rules applicable to the reactants together with an amino acid set, summed over the
+    sets, and are found through the rule index of the (prewarmed) grammar without constructing any state.
+    :param candidate_sets: the candidate rules of each amino acid set if already queried, e.g. by
+        `BatchDependencies.candidate_sets`.
+    """
+    if candidate_sets is None:
+        reactant_spectrum = AtomSpectrum.from_graphs(reactants)
+        candidate_sets = [grammar_rules.rule_index.candidates(reactant_spectrum + AtomSpectrum.from_graphs(aminos))
+                          for aminos in amino_sets]
+    candidate_rules = sum(len(candidate_rules) for candidate_rules in candidate_sets)
+    return {"reactants": len(reactants),
+            "atoms": sum(graph.numVertices for graph in reactants),
+            "candidate_rules": candidate_rules,
+            "amino_sets": len(amino_sets)}
+
+
+def _design_row(features: Dict[str, float]) -> np.ndarray:
+    return np.array([1.0] + [math.log1p(features.get(name, 0)) for name in feature_names])
+
+
+class CostModel:
+    """
+    Log-linear estimate of the runtime of a reaction, `log(runtime) = c_0 + sum_i c_i * log(1 + feature_i)`, fitted by
+    least squares on the records of earlier batches. Reactions completed by an earlier batch are estimated by their
+    recorded runtime instead. Timed out reactions enter the fit with their (censored) runtime, i.e., the time limit.
+    """
+
+    def __init__(self, coefficients: Optional[np.ndarray] = None, history: Optional[Dict[str, float]] = None):
+        self._coefficients: Optional[np.ndarray] = coefficients
+        self._history: Dict[str, float] = dict(history) if history is not None else {}
+
+    @staticmethod
+    def fit(records: Iterable[Dict[str, Any]]) -> 'CostModel':
+        rows: List[np.ndarray] = []
+        targets: List[float] = []
+        history: Dict[str, float] = {}
+        for record in records:
+            if record.get("status") not in ("completed", "timed_out") or "features" not in record:
+                continue
+
+            rows.append(_design_row(record["features"]))
+            targets.append(math.log(max(record["runtime"], 1e-3)))
+            if record["status"] == "completed":
+                history[record["key"]] = record["runtime"]
+
+        coefficients = None
+        if len(rows) > len(feature_names):
+            coefficients = np.linalg.lstsq(np.vstack(rows), np.array(targets), rcond=None)[0]
+
+        return CostModel(coefficients, history)
+
+    @staticmethod
+    def from_manifests(manifests: Iterable[Manifest]) -> 'CostModel':
+        records: Dict[str, Dict[str, Any]] = {}
+        for manifest in manifests:
+            records.update(manifest.records)
+
+        return CostModel.fit(records.values())
+
+    def estimate(self, features: Dict[str, float]) -> float:
+        """The expected runtime in seconds, without a fitted model the product of the features is used as a proxy."""
+        if self._coefficients is None:
+            return float(np.prod([1 + features.get(name, 0) for name in feature_names]))
+
+        return float(math.exp(_design_row(features) @ self._coefficients))
+
+    def expected_runtime(self, task: Task) -> float:
+        if task.key in self._history:
+            return self._history[task.key]
+
+        return self.estimate(task.features if task.features is not None else {})
+
+
+def simulated_makespan(runtimes: Sequence[float], num_workers: int) -> float:
+    """The makespan of running the tasks in the given order, each on the first worker that becomes idle."""
+    workers = [0.0] * num_workers
+    for runtime in runtimes:
+        heapq.heapreplace(workers, workers[0] + runtime)
+
+    return max(workers)
+
+
+def _ranks(values: Sequence[float]) -> np.ndarray:
+    order = np.argsort(values, kind="stable")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(len(values))
+    return ranks
+
+
+def evaluate(records: Sequence[Dict[str, Any]], folds: int = 5, num_workers: int = 1) -> Dict[str, float]:
+    """
+    Cross-validates the cost model on the completed reactions of recorded runs.
+    :param records: manifest records holding the features and runtimes of reactions.
+    :param folds: the number of folds, the model predicting each fold is fitted on the others without their history.
+    :param num_workers: the number of workers for which the scheduling quality is simulated.
+    :return: the Spearman rank correlation and mean absolute error (in seconds) of the estimated runtimes, and the
+        simulated makespan of scheduling by decreasing estimate relative to the recorded order and to scheduling by
+        decreasing actual runtime.
+    """
+    records = [record for record in records if record.get("status") == "completed" and "features" in record]
+    if len(records) < 2:
+        raise ValueError("at least two completed reactions with features are needed")
+
+    estimates: List[float] = [0.0] * len(records)
+    for fold in range(folds):
+        training = [record for index, record in enumerate(records) if index % folds != fold]
+        model = CostModel.fit(training)
+        for index in range(fold, len(records), folds):
+            estimates[index] = model.estimate(records[index]["features"])
+
+    runtimes = np.array([record["runtime"] for record in records])
+    estimated = np.array(estimates)
+    correlation = float(np.corrcoef(_ranks(runtimes), _ranks(estimated))[0, 1])
+
+    scheduled = [runtimes[index] for index in np.argsort(-estimated, kind="stable")]
+    return {"spearman": correlation,
+            "mean_absolute_error": float(np.mean(np.abs(runtimes - estimated))),
+            "makespan_recorded_order": simulated_makespan(list(runtimes), num_workers),
+            "makespan_estimated_order": simulated_makespan(scheduled, num_workers),
+            "makespan_runtime_order": simulated_makespan(sorted(runtimes, reverse=True), num_workers)}
+
+
+if __name__ == "__main__":
+    # python -m scripts.rhea_analysis.cost_model <manifest.jsonl> [num_workers]
+    for name, value in evaluate(list(Manifest(sys.argv[1]).records.values()),
+                                num_workers=int(sys.argv[2]) if len(sys.argv) > 2 else 1).items():
+        print(f"{name}: {value:.3f}")
@@ -0,0 +1,65 @@
+from mechsearch.atom_spectrum import AtomSpectrum
+from mechsearch.grammar import Grammar
+from mechsearch.graph import Rule
+from mechsearch.result_cache import canonical_multiset
+import mod
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Sequence
+
+# dependencies only recorded for reference, a changed rule set only invalidates the reactions whose candidates changed
+ignored_dependencies = ("rules",)
+
+
+def reaction_hash(reactants: Sequence[mod.Graph], products: Sequence[mod.Graph]) -> str:
+    content = {"reactants": canonical_multiset(reactants), "products": canonical_multiset(products)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class BatchDependencies:
+    """
+    The inputs the stored results of the reactions of a batch depend on. Atoms are conserved by every rule, so a rule
+    can only be applied in the state space of the reactants with an amino acid set if the combined atom spectrum
+    covers the rule, i.e., if it is among the filtered candidate rules. Changes to any other rule cannot change the
+    result.
+
+    The fingerprint of the whole grammar is computed once per batch and the digest of the GML string of a rule at
+    most once, so the dependencies of a reaction cost a query of the rule index per amino acid set.
+    """
+
+    def __init__(self, grammar_rules: Grammar, parameters: Dict[str, Any]):
+        self._grammar_rules: Grammar = grammar_rules
+        self._parameters: Dict[str, Any] = parameters
+        self._rule_fingerprint: str = grammar_rules.rule_fingerprint
+        self._rule_digests: Dict[int, bytes] = {}
+
+    def _rule_digest(self, rule: Rule) -> bytes:
+        if rule.rule.id not in self._rule_digests:
+            self._rule_digests[rule.rule.id] = hashlib.sha256(rule.rule.getGMLString().encode()).digest()
+
+        return self._rule_digests[rule.rule.id]
+
+    def _candidates_fingerprint(self, candidates: Iterable[Rule]) -> str:
+        digest = hashlib.sha256()
+        for rule_digest in sorted(self._rule_digest(rule) for rule in candidates):
+            digest.update(rule_digest)
+
+        return digest.hexdigest()
+
+    def candidate_sets(self, reactants: Sequence[mod.Graph],
+                       amino_sets: Sequence[Sequence[mod.Graph]]) -> List[List[Rule]]:
+        """The candidate rules of the reactants together with each of the amino acid sets."""
+        reactant_spectrum = AtomSpectrum.from_graphs(reactants)
+        return [self._grammar_rules.rule_index.candidates(reactant_spectrum + AtomSpectrum.from_graphs(aminos))
+                for aminos in amino_sets]
+
+    def dependencies(self, reactants: Sequence[mod.Graph], products: Sequence[mod.Graph],
+                     amino_sets: Sequence[Sequence[mod.Graph]],
+                     candidate_sets: Sequence[Sequence[Rule]]) -> Dict[str, Any]:
+        """:param candidate_sets: the candidate rules of the reaction, see `candidate_sets`."""
+        candidates = {rule for candidate_rules in candidate_sets for rule in candidate_rules}
+        return {"rules": self._rule_fingerprint,
+                "candidate_rules": self._candidates_fingerprint(candidates),
+                "reaction": reaction_hash(reactants, products),
+                "aminos": sorted(set(canonical_multiset(amino for aminos in amino_sets for amino in aminos))),
+                "parameters": self._parameters}
@@ -0,0 +1,263 @@
+from mechsearch.archive import StateSpaceArchive
+from scripts.rhea_analysis.analysis_engine import AnalysisEngine
+import scripts.rhea_analysis.util as util
+import gc
+import json
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class StageCounter:
+    """The number of items a pipeline stage processed and the time its threads or processes spent on them."""
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.items: int = 0
+        self.busy: float = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def report(self, wall_time: float) -> str:
+        rate = self.items / wall_time if wall_time > 0 else 0.0
+        per_item = self.busy / self.items if self.items > 0 else 0.0
+        return f"{self.name}: {self.items} items, {rate:.2f} items/s, {per_item:.3f}s busy per item"
+
+
+def _search_worker(engine: AnalysisEngine, load_queue, connection):
+    # messages are sent through a pipe of the worker, which unlike a queue writes them before `send` returns, so the
+    # supervisor receives everything a killed worker sent, including the reaction it was searching
+    while True:
+        item = load_queue.get()
+        if item is None:
+            break
+
+        rhea_id, state_space_json, dg_dump = item
+        connection.send(("started", rhea_id))
+        start = time.monotonic()
+        loaded = start
+        try:
+            state_space = engine.load_dump(rhea_id, state_space_json, dg_dump)
+            loaded = time.monotonic()
+            result = engine.search(rhea_id, state_space)
+        except Exception:
+            result = {"rhea_id": rhea_id, "error": traceback.format_exc()}
+        end = time.monotonic()
+        connection.send(("finished", result, {"load": loaded - start, "search": end - loaded}))
+
+    connection.send(("exited",))
+    connection.close()
+
+
+class Pipeline:
+    """
+    Streaming version of `AnalysisEngine.run` that overlaps reading the stored state spaces with searching them.
+
+    - `num_readers` threads of the supervising process read and decode the state space JSON and the DG dump of the
+      next reactions into a queue holding at most `queue_size` reactions.
+    - `num_workers` forked worker processes load the DGs from the dumps and run the path query of the engine.
+      MOD objects cannot be passed between processes, so the DGs are loaded by the workers searching them.
+    - The supervising process writes the results as JSON lines in the order they arrive.
+
+    Every reaction gets a line. The reaction held by a worker that dies, e.g. killed by the kernel, is written with
+    an error, and once no worker is left the readers stop and the reactions not searched are written with an error.
+
+    The number of reactions, the rate and the busy time per reaction of the stages "read", "load", "search" and
+    "write" are counted and reported when the pipeline is done.
+    """
+
+    def __init__(self, engine: AnalysisEngine, num_readers: int = 2, num_workers: Optional[int] = None,
+                 queue_size: int = 16, poll_interval: float = 1.0):
+        self._engine: AnalysisEngine = engine
+        self._num_readers: int = num_readers
+        self._num_workers: int = num_workers if num_workers is not None else os.cpu_count()
+        self._queue_size: int = queue_size
+        self._poll_interval: float = poll_interval
+        self._counters: Dict[str, StageCounter] = {name: StageCounter(name) for
+                                                   name in ("read", "load", "search", "write")}
+
+    @property
+    def counters(self) -> Dict[str, StageCounter]:
+        return self._counters
+
+    def _put(self, load_queue, item, stop: threading.Event) -> bool:
+        """Puts the item on the load queue unless the pipeline is stopped first, and returns whether it did."""
+        while not stop.is_set():
+            try:
+                load_queue.put(item, timeout=self._poll_interval)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _read(self, rhea_ids: "queue.Queue[str]", load_queue, read_errors: "queue.Queue[Dict[str, Any]]",
+              stop: threading.Event):
+        archive_path = os.path.join(self._engine.root_dir, util.archive_file_name)
+        archive = StateSpaceArchive(archive_path) if os.path.exists(archive_path) else None
+        while not stop.is_set():
+            try:
+                rhea_id = rhea_ids.get_nowait()
+            except queue.Empty:
+                break
+
+            start = time.monotonic()
+            try:
+                item = (rhea_id, *util.read_stored_state_space(self._engine.root_dir, rhea_id, archive))
+            except Exception:
+                # reported by the writer as any other failed reaction
+                read_errors.put({"rhea_id": rhea_id, "error": traceback.format_exc()})
+                continue
+            self._counters["read"].record(time.monotonic() - start)
+            if not self._put(load_queue, item, stop):
+                # reported with the other reactions that were not searched
+                rhea_ids.put(rhea_id)
+
+    def _unsearched(self, rhea_ids: "queue.Queue[str]", load_queue) -> List[str]:
+        """Takes the reactions still pending or queued for the workers, once the readers have stopped."""
+        unsearched: List[str] = []
+        while True:
+            try:
+                item = load_queue.get(timeout=self._poll_interval)
+            except queue.Empty:
+                break
+            if item is not None:
+                unsearched.append(item[0])
+
+        while not rhea_ids.empty():
+            unsearched.append(rhea_ids.get_nowait())
+
+        return unsearched
+
+    def run(self, output_path: str, rhea_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        Writes the summary of every reaction to `output_path` as a JSON line and returns the number per outcome.
+        :param rhea_ids: the reactions to analyse, by default all stored reactions.
+        """
+        rhea_ids = list(rhea_ids) if rhea_ids is not None else util.stored_reaction_ids(self._engine.root_dir)
+        pending: "queue.Queue[str]" = queue.Queue()
+        for rhea_id in rhea_ids:
+            pending.put(rhea_id)
+
+        context = mp.get_context("fork")
+        load_queue = context.Queue(self._queue_size)
+        read_errors: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        pipes = [context.Pipe(duplex=False) for _ in range(self._num_workers)]
+
+        start = time.monotonic()
+        # the workers are forked before any thread is started, and share the prepared engine with the supervisor
+        gc.collect()
+        gc.freeze()
+        workers: List[mp.Process] = [context.Process(target=_search_worker, name=f"search-{i}", daemon=True,
+                                                     args=(self._engine, load_queue, sender))
+                                     for i, (_, sender) in enumerate(pipes)]
+        for worker in workers:
+            worker.start()
+        gc.unfreeze()
+        for _, sender in pipes:
+            sender.close()
+
+        stop = threading.Event()
+        readers = [threading.Thread(target=self._read, args=(pending, load_queue, read_errors, stop),
+                                    name=f"read-{i}", daemon=True) for i in range(self._num_readers)]
+        for reader in readers:
+            reader.start()
+
+        def close_load_queue():
+            for reader in readers:
+                reader.join()
+            for _ in workers:
+                if not self._put(load_queue, None, stop):
+                    break
+
+        closer = threading.Thread(target=close_load_queue, name="close", daemon=True)
+        closer.start()
+
+        counts = {"paths": 0, "no_paths": 0, "errors": 0}
+        # the connection of every worker that has not exited and the reaction held by each worker
+        connections: Dict[int, Any] = {i: receiver for i, (receiver, _) in enumerate(pipes)}
+        in_flight: Dict[int, str] = {}
+        try:
+            with open(output_path, "w") as f:
+                def write(result: Dict[str, Any], timings: Dict[str, float]):
+                    write_start = time.monotonic()
+                    f.write(json.dumps(result) + "\n")
+                    f.flush()
+                    self._counters["write"].record(time.monotonic() - write_start)
+                    for name, seconds in timings.items():
+                        self._counters[name].record(seconds)
+
+                    outcome = "errors" if "error" in result else "paths" if result["paths"] else "no_paths"
+                    counts[outcome] += 1
+
+                def receive(i: int):
+                    try:
+                        message = connections[i].recv()
+                    except EOFError:
+                        message = ("exited",)
+
+                    if message[0] == "started":
+                        in_flight[i] = message[1]
+                    elif message[0] == "finished":
+                        del in_flight[i]
+                        write(*message[1:])
+                    else:
+                        connections.pop(i).close()
+
+                while connections:
+                    while not read_errors.empty():
+                        write(read_errors.get_nowait(), {})
+
+                    ready = set(mp.connection.wait(list(connections.values()), timeout=self._poll_interval))
+                    for i in [i for i, connection in connections.items() if connection in ready]:
+                        receive(i)
+
+                    for i in list(connections):
+                        if workers[i].is_alive():
+                            continue
+                        # e.g., killed by the kernel, everything it sent before is still in its pipe
+                        while i in connections and connections[i].poll():
+                            receive(i)
+                        if i in connections:
+                            connections.pop(i).close()
+                        if i in in_flight:
+                            write({"rhea_id": in_flight.pop(i),
+                                   "error": f"search worker exited with code {workers[i].exitcode}"}, {})
+
+                # without workers, the readers stop and the reactions they have not handed over are not searched
+                stop.set()
+                closer.join()
+                while not read_errors.empty():
+                    write(read_errors.get_nowait(), {})
+                for rhea_id in self._unsearched(pending, load_queue):
+                    write({"rhea_id": rhea_id, "error": "not searched, no search worker is left"}, {})
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join(self._poll_interval)
+                if worker.is_alive():
+                    worker.kill()
+                    worker.join()
+
+        wall_time = time.monotonic() - start
+        for counter in self._counters.values():
+            print(counter.report(wall_time))
+        return counts
+
+
+if __name__ == "__main__":
+    # python -m scripts.rhea_analysis.pipeline <root_dir> <output.jsonl> [num_workers] [num_readers]
+    pipeline = Pipeline(AnalysisEngine(sys.argv[1]),
+                        num_workers=int(sys.argv[3]) if len(sys.argv) > 3 else None,
+                        num_readers=int(sys.argv[4]) if len(sys.argv) > 4 else 2)
+    print(pipeline.run(sys.argv[2]))
@@ -1,14 +1,12 @@
 from data.rhea.db import RheaDB
+from mechsearch.constraints import AllOf, ConstrainedStateSpace, UsesAminoAcid, UsesDistinctMCSAEntries
 from mechsearch.grammar import Grammar
 from mechsearch.state_space import StateSpace, Path
-from mechsearch.graph import Rule
 import mechsearch.explore as explore
 import scripts.rhea_analysis.util as util
 import mod
-import os
 import json
 import itertools
-from typing import List, Dict
 
 
 def store_readable_paths(root_dir, filepath):
@@ -26,47 +24,27 @@ def store_readable_paths(root_dir, filepath):
     rhea_db = RheaDB()
     count = 0
 
-    def uses_amino_acid(path: Path):
-        for edge in path:
-            for he in edge.transitions:
-                for hv in he.sources:
-                    v: mod.GraphVertex
-                    for v in hv.graph.vertices:
-                        if v.stringLabel.startswith("Amino"):
-                            return True
-        return False
-
-    def uses_different_rule_mechanisms(path: Path):
-        modrule2rule: Dict[mod.Rule, Rule] = {r.rule: r for r in grammar_rules.rules}
-        used_rules: List[Rule] = []
-        for edge in path:
-            for he in edge.transitions:
-                used_rules.extend([modrule2rule[r] for r in he.rules if r in modrule2rule])
-
-        used_mcsa_entries = set(step.entry for r in used_rules for step in r.steps)
-        return len(used_mcsa_entries) > 1
+    # the constraints are checked during the search, so only interesting mechanisms are enumerated
+    constraint = AllOf(UsesAminoAcid(), UsesDistinctMCSAEntries(grammar_rules, 2))
 
     num_no_amino_paths = 0
     paths = []
-    for rhea_id in os.listdir(input_dir):
+    for rhea_id in util.stored_reaction_ids(input_dir):
         print(rhea_id)
         reaction = rhea_db.get_reaction(rhea_id)
         grammar_reaction = util.reaction2grammar(reaction)
         grammar = grammar_rules + grammar_reaction
-        state_space_dir = os.path.join(input_dir, rhea_id)
-        dg_path = os.path.join(state_space_dir, "dg.dg")
-        state_space_path = os.path.join(state_space_dir, "state_space.json")
-        with open(state_space_path) as f:
-            state_space = StateSpace.from_json(json.load(f), grammar, dg_path)
+        state_space = util.load_stored_state_space(input_dir, rhea_id, grammar)
         print(f"Analyzing StateSpace(|V| = {state_space.number_of_states}, |E| = {len(state_space.graph.edges)})")
         print(f"\t DG(|V| = {state_space.derivation_graph.numVertices}, |E| = {state_space.derivation_graph.numEdges})")
         state_space.freeze()
-        path_generator = explore.shortest_simple_paths(state_space,
+        constrained_space = ConstrainedStateSpace(state_space, constraint)
+        path_generator = explore.shortest_simple_paths(constrained_space,
                                                        algorithm="bidirectional_dijkstra")
         print("Computing Paths...")
-        path = list(itertools.islice(path_generator, 1))[0]
+        path = next(path_generator, None)
 
-        if not uses_amino_acid(path) or not uses_different_rule_mechanisms(path):
+        if path is None:
             num_no_amino_paths += 1
             continue
 
@@ -102,46 +80,26 @@ def print_interesting_paths(root_dir: str):
     rhea_db = RheaDB()
     count = 0
 
-    def uses_amino_acid(path: Path):
-        for edge in path:
-            for he in edge.transitions:
-                for hv in he.sources:
-                    v: mod.GraphVertex
-                    for v in hv.graph.vertices:
-                        if v.stringLabel.startswith("Amino"):
-                            return True
-        return False
-
-    def uses_different_rule_mechanisms(path: Path):
-        modrule2rule: Dict[mod.Rule, Rule] = {r.rule: r for r in grammar_rules.rules}
-        used_rules: List[Rule] = []
-        for edge in path:
-            for he in edge.transitions:
-                used_rules.extend([modrule2rule[r] for r in he.rules if r in modrule2rule])
-
-        used_mcsa_entries = set(step.entry for r in used_rules for step in r.steps)
-        return len(used_mcsa_entries) > 1
+    # the constraints are checked during the search, so only interesting mechanisms are enumerated
+    constraint = AllOf(UsesAminoAcid(), UsesDistinctMCSAEntries(grammar_rules, 2))
 
     num_no_amino_paths = 0
-    for rhea_id in os.listdir(input_dir):
+    for rhea_id in util.stored_reaction_ids(input_dir):
         print(rhea_id)
         reaction = rhea_db.get_reaction(rhea_id)
         grammar_reaction = util.reaction2grammar(reaction)
         grammar = grammar_rules + grammar_reaction
-        state_space_dir = os.path.join(input_dir, rhea_id)
-        dg_path = os.path.join(state_space_dir, "dg.dg")
-        state_space_path = os.path.join(state_space_dir, "state_space.json")
-        with open(state_space_path) as f:
-            state_space = StateSpace.from_json(json.load(f), grammar, dg_path)
+        state_space = util.load_stored_state_space(input_dir, rhea_id, grammar)
         print(f"Analyzing StateSpace(|V| = {state_space.number_of_states}, |E| = {len(state_space.graph.edges)})")
         print(f"\t DG(|V| = {state_space.derivation_graph.numVertices}, |E| = {state_space.derivation_graph.numEdges})")
         state_space.freeze()
-        path_generator = explore.shortest_simple_paths(state_space,
+        constrained_space = ConstrainedStateSpace(state_space, constraint)
+        path_generator = explore.shortest_simple_paths(constrained_space,
                                                        algorithm="bidirectional_dijkstra")
         print("Computing Paths...")
         paths = list(itertools.islice(path_generator, 1))
 
-        if not uses_amino_acid(paths[0]) or not uses_different_rule_mechanisms(paths[0]):
+        if not paths:
             num_no_amino_paths += 1
             continue
 
@@ -184,7 +142,7 @@ def print_paths(root_dir="state_space",
     num_no_amino_paths = 0
     paths = []
     serial_paths = []
-    for rhea_id in os.listdir(input_dir):
+    for rhea_id in util.stored_reaction_ids(input_dir):
         print(rhea_id)
         if rhea_id not in ["RHEA:12024",
                            #"RHEA:24116"
@@ -195,11 +153,7 @@ def print_paths(root_dir="state_space",
         grammar = grammar_rules + grammar_reaction
         grammar.append_initial([g.graph for g in grammar_aminos.graphs])
         grammar.append_target([g.graph for g in grammar_aminos.graphs])
-        state_space_dir = os.path.join(input_dir, rhea_id)
-        dg_path = os.path.join(state_space_dir, "dg.dg")
-        state_space_path = os.path.join(state_space_dir, "state_space.json")
-        with open(state_space_path) as f:
-            state_space = StateSpace.from_json(json.load(f), grammar, dg_path)
+        state_space = util.load_stored_state_space(input_dir, rhea_id, grammar)
         print(f"Analyzing StateSpace(|V| = {state_space.number_of_states}, |E| = {len(state_space.graph.edges)})")
         print(f"\t DG(|V| = {state_space.derivation_graph.numVertices}, |E| = {state_space.derivation_graph.numEdges})")
         state_space.freeze()
@@ -1,11 +1,14 @@
 import mod
+from mechsearch.archive import StateSpaceArchive
 from mechsearch.grammar import Grammar
 from mechsearch.state_space import StateSpace, StateSpaceNode
 import os
 import json
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Optional, Set, Tuple
 
 mechanism_grammar_dir = "../mcsadb/data/grammars"
+# file name of the archive holding the state spaces of a batch, as an alternative to a directory per reaction
+archive_file_name = "state_spaces.archive"
 
 
 def get_mechanism_names():
@@ -13,6 +16,48 @@ def get_mechanism_names():
         yield grammar_file.split('.')[0].strip()
 
 
+def stored_reaction_ids(root_dir: str) -> List[str]:
+    # the directory also holds the batch manifest and possibly temporary directories of unfinished reactions
+    reaction_ids = [name for name in os.listdir(root_dir) if
+                    name.startswith("RHEA:") and os.path.isdir(os.path.join(root_dir, name))]
+    archive_path = os.path.join(root_dir, archive_file_name)
+    if os.path.exists(archive_path):
+        reaction_ids.extend(rhea_id for rhea_id in StateSpaceArchive(archive_path).keys() if
+                            rhea_id not in reaction_ids)
+    return reaction_ids
+
+
+def load_stored_state_space(root_dir: str, rhea_id: str, grammar: Grammar) -> StateSpace:
+    """Loads the state space of the reaction from "root_dir/RHEA_ID/" or else from the archive in "root_dir"."""
+    state_space_dir = os.path.join(root_dir, rhea_id)
+    if not os.path.isdir(state_space_dir):
+        return StateSpaceArchive(os.path.join(root_dir, archive_file_name)).load_state_space(rhea_id, grammar)
+
+    dg_path = os.path.join(state_space_dir, "dg.dg")
+    state_space_path = os.path.join(state_space_dir, "state_space.json")
+    with open(state_space_path) as f:
+        return StateSpace.from_json(json.load(f), grammar, dg_path)
+
+
+def read_stored_state_space(root_dir: str, rhea_id: str,
+                            archive: Optional[StateSpaceArchive] = None) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Reads the state space JSON and the DG dump of the reaction stored as for `load_stored_state_space`, without
+    loading the DG. An opened archive of "root_dir" may be given to avoid reading its index again.
+    """
+    state_space_dir = os.path.join(root_dir, rhea_id)
+    if not os.path.isdir(state_space_dir):
+        if archive is None:
+            archive = StateSpaceArchive(os.path.join(root_dir, archive_file_name))
+        return archive.read(rhea_id)
+
+    with open(os.path.join(state_space_dir, "state_space.json")) as f:
+        state_space_json = json.load(f)
+    with open(os.path.join(state_space_dir, "dg.dg"), "rb") as f:
+        dg_dump = f.read()
+    return state_space_json, dg_dump
+
+
 def load_rules():
     # rules_file_path = "../mcsadb/data/rules/aminos_groups_context1_no_H.json"
     rules_file_path = "data/rules.json"
@@ -0,0 +1,21 @@
+import pytest
+
+mod = pytest.importorskip("mod")
+
+from mechsearch.grammar import Grammar
+from mechsearch.state_space import StateSpace
+
+
+def test_construct_non_empty_state_space():
+    grammar = Grammar()
+    grammar.append_initial([mod.smiles("O", "Water", add=False)])
+    grammar.append_target([mod.smiles("[OH-]", "Hydroxide", add=False)])
+
+    state_space = StateSpace(grammar)
+
+    assert state_space.number_of_states == 2
+    assert state_space.initial_node != state_space.target_node
+    assert state_space.num_edges == 0
+    # the index follows the states added by the constructor
+    state_space.index
+    assert state_space._index_version == state_space._version